@@ -1,19 +1,39 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import google.generativeai as genai
+import copy
 import json
 import os
 import hashlib
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = "gemini-3-flash-preview"
 
 # Configuration
 CACHE_FILE = "menu_cache.json"
 CACHE_DURATION_HOURS = 24
+HTTP_CACHE_FILE = "http_cache.json"  # ETag/Last-Modified + table text per URL
+DISH_CACHE_FILE = "dish_cache.json"  # per-dish verdicts reused across weeks
+TOKEN_USAGE_FILE = "token_usage.json"  # Gemini tokens per day / run
+RESPONSE_STORE_DIR = "llm_responses"  # Gemini replies keyed by prompt hash
+DISH_CACHE_MAX_ENTRIES = 3000
+DISH_CACHE_TTL_DAYS = 180
+DISH_CACHE_TOUCH_DAYS = 7  # a hit only rewrites "seen" once it is this old
 
 URLS = {
     "Student Cafeteria": "https://www.kumoh.ac.kr/ko/restaurant01.do",
@@ -21,34 +41,242 @@ URLS = {
     "A La Carte": "https://www.kumoh.ac.kr/ko/restaurant04.do"
 }
 
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+
+# --- METRICS ---
+METRICS_FILE = "metrics.json"
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]  # seconds
+
+class Metrics:
+    """Process-wide counters and latency histograms.
+
+    span()/timed() record durations per name; count() bumps counters.
+    Export with to_dict() (JSON file) or prometheus_text().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}  # name -> {"count", "sum", "max", "buckets": [per LATENCY_BUCKETS + inf]}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {"count": 0, "sum": 0.0, "max": 0.0,
+                                             "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+            index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            timer["buckets"][index] += 1
+
+    @contextmanager
+    def span(self, name):
+        """with metrics.span("stage"): ... records the block's wall time (also on error)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator form of span()."""
+        def wrap(fn):
+            @wraps(fn)
+            def inner(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "generated_at": datetime.now().isoformat(),
+                "counters": dict(self.counters),
+                "timers": {
+                    name: {"count": t["count"], "sum": round(t["sum"], 6), "max": round(t["max"], 6),
+                           "avg": round(t["sum"] / t["count"], 6) if t["count"] else 0,
+                           "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], t["buckets"]))}
+                    for name, t in self.timers.items()
+                }
+            }
+
+    def prometheus_text(self):
+        """Prometheus text exposition: counters as *_total, timers as *_seconds histograms."""
+        metric = lambda name: "halal_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {metric(name)}_total counter")
+                lines.append(f"{metric(name)}_total {value}")
+            for name, t in sorted(self.timers.items()):
+                base = metric(name) + "_seconds"
+                lines.append(f"# TYPE {base} histogram")
+                cumulative = 0
+                for bound, hits in zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], t["buckets"]):
+                    cumulative += hits
+                    lines.append(f'{base}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f"{base}_sum {t['sum']:.6f}")
+                lines.append(f"{base}_count {t['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=10):
+        """Slowest stages by total time, for the end-of-run printout."""
+        with self.lock:
+            timers = sorted(self.timers.items(), key=lambda item: item[1]["sum"], reverse=True)[:top]
+        return [f"   ⏱️ {name}: {t['count']}× avg {t['sum'] / t['count']:.3f}s, max {t['max']:.3f}s, total {t['sum']:.2f}s"
+                for name, t in timers]
+
+metrics = Metrics()
+
+def save_metrics(path=None):
+    """Write the current metrics to METRICS_FILE (JSON)."""
+    atomic_write_json(path or METRICS_FILE, metrics.to_dict(), indent=2)
+
+def serve_metrics(port):
+    """Expose /metrics in Prometheus text format on localhost:port (daemon thread)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"📈 Metrics at http://127.0.0.1:{port}/metrics")
+    return server
+
 # --- CACHE FUNCTIONS ---
-def load_cache():
-    """Load cached menu analysis."""
+def atomic_write_json(path, data, **dump_args):
+    """Write JSON to a temp file next to path, then rename it over path.
+
+    Readers never see a half-written file, even if we crash mid-write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
     try:
-        if os.path.exists(CACHE_FILE):
-            with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, **dump_args)
+        os.replace(tmp_path, path)
     except:
-        pass
-    return {}
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class MenuCache:
+    """menu_cache.json parsed once and kept in memory.
+
+    The file is re-read only when its mtime changes (another process wrote
+    it). Writes go through atomic_write_json and only happen when dirty.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+        self.mtime = None
+        self.dirty = False
+        self.lock = threading.RLock()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        """Return the in-memory cache dict, reloading if the file changed on disk."""
+        with self.lock:
+            mtime = self._file_mtime()
+            if self.data is None or (mtime != self.mtime and not self.dirty):
+                metrics.count("menu_cache.reload")
+                self.data = {}
+                try:
+                    if mtime is not None:
+                        with open(self.path, "r", encoding="utf-8") as f:
+                            self.data = json.load(f)
+                except:
+                    pass
+                self.mtime = mtime
+            else:
+                metrics.count("menu_cache.memory_hit")
+            return self.data
+
+    def set(self, day, entry):
+        with self.lock:
+            self.load()[day] = entry
+            self.dirty = True
+            self.flush()
+
+    def replace(self, data):
+        with self.lock:
+            self.data = data
+            self.dirty = True
+            self.flush()
 
+    def update(self, mutate):
+        """Apply mutate(data) and write back, all under the lock.
+
+        Read-modify-write in one critical section, so concurrent writers
+        can't overwrite each other's days.
+        """
+        with self.lock:
+            mutate(self.load())
+            self.dirty = True
+            self.flush()
+
+    def flush(self):
+        """Write back if anything changed since the last write."""
+        with self.lock:
+            if not self.dirty:
+                return
+            with metrics.span("menu_cache.write"):
+                atomic_write_json(self.path, self.data, indent=2)
+            self.mtime = self._file_mtime()
+            self.dirty = False
+
+_menu_cache = None
+
+def get_menu_cache():
+    """Process-wide MenuCache for CACHE_FILE."""
+    global _menu_cache
+    if _menu_cache is None or _menu_cache.path != CACHE_FILE:
+        _menu_cache = MenuCache(CACHE_FILE)
+    return _menu_cache
+
+@metrics.timed("menu_cache.load")
+def load_cache():
+    """Load cached menu analysis."""
+    return get_menu_cache().load()
+
+@metrics.timed("menu_cache.save")
 def save_cache(day, analysis, menu_hash=None):
     """Save menu analysis to cache with menu hash for change detection."""
-    cache = load_cache()
-    # If overwriting, preserve existing menu_hash if new one not provided (though usually provided)
-    # Actually, simplistic approach: just overwrite.
-    cache[day] = {
+    get_menu_cache().set(day, {
         "timestamp": datetime.now().isoformat(),
         "analysis": analysis,
         "menu_hash": menu_hash
-    }
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+    })
 
+@metrics.timed("menu_cache.save")
 def save_full_cache(cache_data):
     """Save the entire cache dictionary (used by bulk operations)."""
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache_data, f, ensure_ascii=False, indent=2)
+    get_menu_cache().replace(cache_data)
+
+def update_cache(mutate):
+    """Serialized read-modify-write of the cache (mutate gets the cache dict)."""
+    get_menu_cache().update(mutate)
 
 def is_cache_valid(day):
     """Check if cache for a day is still valid."""
@@ -67,9 +295,12 @@ def get_cached_analysis(day):
     """Get cached analysis for a day."""
     cache = load_cache()
     if day in cache:
+        metrics.count("analysis_cache.hit")
         return cache[day].get("analysis")
+    metrics.count("analysis_cache.miss")
     return None
 
+@metrics.timed("menu.hash")
 def get_menu_hash(menu_text):
     """Generate hash of menu text to detect changes."""
     return hashlib.md5(menu_text.encode()).hexdigest()
@@ -82,75 +313,759 @@ def has_menu_changed(day, current_hash):
     cached_hash = cache[day].get("menu_hash")
     return cached_hash != current_hash
 
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one computation.
+
+    The first caller for a key runs the work; callers arriving while it is in
+    flight wait and get the same result (or exception). Nothing is kept once
+    the call finishes, so this is de-duplication, not a cache.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        return self.do_many([key], lambda keys: {key: fn()})[key]
+
+    def do_many(self, keys, fn):
+        """Resolve several keys; fn(owned_keys) -> {key: result} runs only for keys nobody else is computing."""
+        with self.lock:
+            waiting = {key: self.calls[key] for key in keys if key in self.calls}
+            owned = [key for key in keys if key not in waiting]
+            for key in owned:
+                self.calls[key] = self._Call()
+        
+        results = {}
+        if owned:
+            error, produced = None, {}
+            try:
+                produced = fn(owned) or {}
+            except Exception as e:
+                error = e
+            with self.lock:
+                for key in owned:
+                    call = self.calls.pop(key)
+                    call.result, call.error = produced.get(key), error
+                    call.done.set()
+            if error:
+                raise error
+            results.update((key, produced.get(key)) for key in owned)
+        
+        for key, call in waiting.items():
+            call.done.wait()
+            if call.error:
+                raise call.error
+            results[key] = call.result
+        return results
+
+# --- MENU MODEL ---
+# Header cells look like "월(01.12)" or "Mon"; map their first letters to weekdays
+DAY_MARKERS = {
+    "월": "Monday", "화": "Tuesday", "수": "Wednesday", "목": "Thursday", "금": "Friday",
+    "mon": "Monday", "tue": "Tuesday", "wed": "Wednesday", "thu": "Thursday", "fri": "Friday"
+}
+
+def _day_of_header(cell):
+    """Return the weekday a header cell refers to, or None."""
+    cell = cell.strip().lower()
+    return DAY_MARKERS.get(cell[:1]) or DAY_MARKERS.get(cell[:3])
+
+class MenuTable:
+    """One cafeteria's weekly table: cafeteria -> day -> meal -> dishes.
+
+    header holds the first row's cells, rows is a tuple of (meal_label, cells)
+    where each cell is a tuple of dish strings. day_columns maps a weekday to
+    its column in header (empty when the layout has no weekday columns).
+    """
+    __slots__ = ("cafeteria", "header", "rows", "day_columns")
+
+    def __init__(self, cafeteria, header, rows):
+        self.cafeteria = cafeteria
+        self.header = tuple(header)
+        self.rows = tuple((label, tuple(tuple(cell) for cell in cells)) for label, cells in rows)
+        self.day_columns = {}
+        for idx, cell in enumerate(self.header[1:], start=1):
+            day = _day_of_header(cell)
+            if day and day not in self.day_columns:
+                self.day_columns[day] = idx
+
+    @classmethod
+    def from_html(cls, cafeteria, table_tag):
+        """Parse a BeautifulSoup <table>; dishes are the text lines of each cell."""
+        header = []
+        rows = []
+        for row in table_tag.find_all('tr'):
+            cols = row.find_all(['th', 'td'])
+            if not cols:
+                continue
+            if not header:
+                header = [ele.text.strip().replace('\n', ' ') for ele in cols]
+                continue
+            label = cols[0].text.strip().replace('\n', ' ')
+            cells = [[line.strip() for line in ele.get_text("\n").split("\n") if line.strip()] for ele in cols[1:]]
+            rows.append((label, cells))
+        return cls(cafeteria, header, rows)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["cafeteria"], data["header"], data["rows"])
+
+    def to_dict(self):
+        """JSON-friendly form; from_dict(to_dict()) gives an equal table."""
+        return {
+            "cafeteria": self.cafeteria,
+            "header": list(self.header),
+            "rows": [[label, [list(cell) for cell in cells]] for label, cells in self.rows]
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, MenuTable) and (self.cafeteria, self.header, self.rows) == (other.cafeteria, other.header, other.rows)
+
+    def dishes(self, day):
+        """[(meal_label, dishes), ...] for one day; empty if the day has no column."""
+        idx = self.day_columns.get(day)
+        if idx is None:
+            return []
+        return [(label, cells[idx - 1] if idx - 1 < len(cells) else ()) for label, cells in self.rows]
+
+    def day_text(self, days, meals=None):
+        """Pipe-joined rows for the given day columns only (and only `meals` rows if given)."""
+        columns = [self.day_columns[day] for day in days if day in self.day_columns]
+        if not columns:
+            return ""
+        text = f"{self.header[0]} | " + " | ".join(self.header[idx] for idx in columns) + "\n"
+        for label, cells in self.rows:
+            if meals is not None and label not in meals:
+                continue
+            text += f"{label} | " + " | ".join(" ".join(cells[idx - 1]) if idx - 1 < len(cells) else "" for idx in columns) + "\n"
+        return text
+
+    def to_text(self):
+        """The whole table as pipe-joined rows (the format prompts have always used)."""
+        text = " | ".join(self.header) + "\n" if self.header else ""
+        for label, cells in self.rows:
+            text += " | ".join([label] + [" ".join(cell) for cell in cells]) + "\n"
+        return text
+
 # --- DATA FETCHING ---
-def get_menu_text(url):
-    """Scrapes the weekly menu table from the website."""
+# Per-cafeteria timeouts in seconds (anything not listed uses FETCH_TIMEOUT)
+FETCH_TIMEOUT = 15
+FETCH_TIMEOUTS = {
+    "A La Carte": 10,
+}
+FETCH_RETRIES = 2            # extra attempts after the first failure
+FETCH_BACKOFF_SECONDS = 1.0  # doubled after every failed attempt
+
+_session = None
+_session_lock = threading.Lock()
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+def get_session():
+    """Shared keep-alive session so every cafeteria page reuses one TLS connection pool."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=len(URLS))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+# --- HTTP VALIDATOR STORE (conditional GET) ---
+def load_http_cache():
+    """Load stored ETag/Last-Modified validators and table text per URL (once per process)."""
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = {}
+            try:
+                if os.path.exists(HTTP_CACHE_FILE):
+                    with open(HTTP_CACHE_FILE, "r", encoding="utf-8") as f:
+                        _http_cache = json.load(f)
+            except:
+                pass
+        return _http_cache
+
+def save_http_cache():
+    """Persist the validator store (called once after a fetch round)."""
+    with _http_cache_lock:
+        if _http_cache is None:
+            return
+        atomic_write_json(HTTP_CACHE_FILE, _http_cache, indent=2)
+
+def remember_validators(url, response, table):
+    """Store the response validators with the parsed table."""
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    http_cache = load_http_cache()
+    with _http_cache_lock:
+        if table is not None and (etag or last_modified):
+            http_cache[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "table": table.to_dict()
+            }
+        else:
+            # Server stopped sending validators, don't keep a stale table around
+            http_cache.pop(url, None)
+
+def get_menu_table(url, cafeteria="", timeout=FETCH_TIMEOUT, session=None):
+    """Scrapes the weekly menu table, sending a conditional request when possible.
+
+    Returns (result, not_modified) where result is a MenuTable, or a message
+    string when the page has no table or could not be fetched. On a 304 the
+    stored table is reused without downloading or parsing the page.
+    """
     try:
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+        cached = load_http_cache().get(url, {})
+        headers = {}
+        if "table" in cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
         
-        menu_table = soup.find('table') 
-        if not menu_table:
-            return "No menu found."
-            
-        menu_text = ""
-        rows = menu_table.find_all('tr')
-        for row in rows:
-            cols = row.find_all(['th', 'td'])
-            row_data = [ele.text.strip().replace('\n', ' ') for ele in cols]
-            menu_text += " | ".join(row_data) + "\n"
-            
-        return menu_text
+        response = (session or requests).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and "table" in cached:
+            metrics.count("fetch.not_modified")
+            return MenuTable.from_dict(cached["table"]), True
+        response.raise_for_status()
+        with metrics.span("menu.parse"):
+            soup = BeautifulSoup(response.text, 'html.parser')
+            menu_table = soup.find('table')
+            table = MenuTable.from_html(cafeteria, menu_table) if menu_table else None
+        remember_validators(url, response, table)
+        return (table if table is not None else "No menu found."), False
     except Exception as e:
-        return f"Error scraping: {e}"
+        return f"Error scraping: {e}", False
 
-def fetch_all_menus():
-    """Fetches menus from all cafeterias and returns combined string."""
+def get_menu_text(url, timeout=FETCH_TIMEOUT, session=None):
+    """Scrapes the weekly menu table from the website."""
+    result, _ = get_menu_table(url, timeout=timeout, session=session)
+    return result.to_text() if isinstance(result, MenuTable) else result
+
+@metrics.timed("fetch.page")
+def fetch_menu(name, url, session=None):
+    """Fetch one cafeteria page with retry + exponential backoff.
+
+    Returns {"text": ..., "table": ..., "seconds": ..., "attempts": ..., "not_modified": ...}
+    where table is the MenuTable (None if the page had no usable table).
+    """
+    timeout = FETCH_TIMEOUTS.get(name, FETCH_TIMEOUT)
+    delay = FETCH_BACKOFF_SECONDS
+    start = time.perf_counter()
+    attempts = 0
+    while True:
+        attempts += 1
+        result, not_modified = get_menu_table(url, cafeteria=name, timeout=timeout, session=session)
+        if isinstance(result, MenuTable) or not result.startswith("Error scraping") or attempts > FETCH_RETRIES:
+            break
+        print(f"   ⚠️ {name}: {result} (retrying in {delay:.1f}s)")
+        metrics.count("fetch.retries")
+        time.sleep(delay)
+        delay *= 2
+    table = result if isinstance(result, MenuTable) else None
+    return {
+        "text": table.to_text() if table else result,
+        "table": table,
+        "seconds": round(time.perf_counter() - start, 3),
+        "attempts": attempts,
+        "not_modified": not_modified
+    }
+
+def fetch_menus(concurrent=True):
+    """Fetches every cafeteria page, in parallel by default.
+
+    Returns {name: fetch_menu() result} in URLS order, so the
+    combined menu (and its hash) does not depend on which page finished first.
+    """
     print("📥 Fetching menus...")
+    session = get_session()
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(URLS)) as pool:
+            futures = {name: pool.submit(fetch_menu, name, url, session) for name, url in URLS.items()}
+            menus = {name: futures[name].result() for name in URLS}
+    else:
+        menus = {name: fetch_menu(name, url, session) for name, url in URLS.items()}
+    save_http_cache()
+    
+    for name, result in menus.items():
+        retry_note = f", {result['attempts']} attempts" if result["attempts"] > 1 else ""
+        cached_note = " (304, unchanged)" if result["not_modified"] else ""
+        print(f"   - {name}: {result['seconds']:.2f}s{retry_note}{cached_note}")
+    return menus
+
+def build_full_menu(menus):
+    """Combine fetch_menus() results into the single text blob used for hashing/prompts."""
     full_menu = ""
-    for name, url in URLS.items():
-        print(f"   - {name}...")
-        full_menu += f"--- {name} ---\n{get_menu_text(url)}\n\n"
+    for name, result in menus.items():
+        full_menu += f"--- {name} ---\n{result['text']}\n\n"
     return full_menu
 
+def fetch_all_menus():
+    """Fetches menus from all cafeterias and returns combined string."""
+    return build_full_menu(fetch_menus())
+
+# --- MENU SLICES ---
+def get_slice_text(menu, days, meals=None):
+    """Rows of one fetch_menus() entry for the given day(s), optionally only some meal rows.
+
+    Falls back to the whole table text when the page has no table or no
+    weekday columns.
+    """
+    if isinstance(days, str):
+        days = [days]
+    table = menu.get("table")
+    if table is None or not table.day_columns:
+        return menu["text"]
+    return table.day_text(days, meals)
+
+def get_slice_hashes(menus):
+    """Hash every (day, cafeteria) slice of fetch_menus() results: {day: {cafeteria: md5}}.
+
+    A cafeteria whose layout can't be parsed hashes its whole table, so any
+    edit there re-checks every day.
+    """
+    return {
+        day: {name: get_menu_hash(get_slice_text(menu, day)) for name, menu in menus.items()}
+        for day in WEEKDAYS
+    }
+
+def get_day_menu_text(menus, days, cafeterias=None, meals=None):
+    """Menu text for the given day(s) only, optionally limited to some cafeterias.
+
+    meals optionally maps cafeteria -> set of meal row labels to keep
+    (None keeps every row of that cafeteria).
+    """
+    day_menu = ""
+    for name, menu in menus.items():
+        if cafeterias is not None and name not in cafeterias:
+            continue
+        day_menu += f"--- {name} ---\n{get_slice_text(menu, days, (meals or {}).get(name))}\n\n"
+    return day_menu
+
+def merge_cafeterias(old_analysis, new_analysis, cafeterias):
+    """Take the given cafeterias from new_analysis, keep the rest of old_analysis."""
+    fresh = {cafe.get("name"): cafe for cafe in new_analysis.get("cafeterias", [])}
+    merged = dict(old_analysis)
+    merged["cafeterias"] = [
+        fresh.get(cafe.get("name"), cafe) if cafe.get("name") in cafeterias else cafe
+        for cafe in old_analysis.get("cafeterias", [])
+    ]
+    known = {cafe.get("name") for cafe in merged["cafeterias"]}
+    merged["cafeterias"] += [cafe for name, cafe in fresh.items() if name in cafeterias and name not in known]
+    return merged
+
 def load_corrections():
     """Load manual corrections from corrections.json."""
+    return read_corrections("corrections.json")[0]
+
+_corrections_state = None  # ((path, mtime), corrections, fingerprint)
+
+def read_corrections(path):
+    """(corrections, fingerprint) for a corrections file, re-read only when its mtime changes."""
+    global _corrections_state
     try:
-        if os.path.exists("corrections.json"):
-            with open("corrections.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("corrections", [])
-    except Exception as e:
-        print(f"Warning: Could not load corrections: {e}")
-    return []
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if _corrections_state is None or _corrections_state[0] != (path, mtime):
+        corrections = []
+        try:
+            if mtime is not None:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    corrections = data.get("corrections", [])
+        except Exception as e:
+            print(f"Warning: Could not load corrections: {e}")
+        fingerprint = get_menu_hash(json.dumps(corrections, sort_keys=True, ensure_ascii=False))
+        _corrections_state = ((path, mtime), corrections, fingerprint)
+    return _corrections_state[1], _corrections_state[2]
 
-# --- AI ANALYSIS ---
-def analyze_with_gemini(menu_data, target_day):
-    """Sends menu text to Gemini to find pork-free options."""
-    if not GEMINI_API_KEY:
-        print("❌ Missing GEMINI_API_KEY")
+# --- DISH VERDICT CACHE ---
+HANGUL = re.compile("[\uac00-\ud7a3]")
+
+def corrections_fingerprint():
+    """Hash of corrections.json content; dish verdicts are dropped when it changes."""
+    load_corrections()  # refreshes _corrections_state if the file changed
+    return _corrections_state[2]
+
+def dish_keys(name):
+    """Normalized lookup keys for a dish name.
+
+    Bracketed notes are dropped ("돈육야채조림(국내산)" -> "돈육야채조림") and a
+    Korean/English pair like "Chicken Curry (닭카레)" yields both names.
+    """
+    name = str(name)
+    outer = re.sub(r"[\(\[\{（<].*?[\)\]\}）>]", " ", name)
+    parts = [outer]
+    for inner in re.findall(r"[\(\[（](.*?)[\)\]）]", name):
+        # Only a translation counts as a second name, not notes like "(국내산)"
+        if bool(HANGUL.search(inner)) != bool(HANGUL.search(outer)):
+            parts.append(inner)
+    keys = []
+    for part in parts:
+        key = re.sub(r"[\s*#·,./]+", " ", part).strip().lower()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+# Example values from the prompt's schema that a lazy reply may echo back
+SCHEMA_PLACEHOLDER = re.compile(r"^(dish name \d*|\.\.\.|list items .*|name of main .*|)$", re.IGNORECASE)
+
+class DishVerdictCache:
+    """Persistent LRU map of normalized dish name -> verdict, with a TTL.
+
+    Entries are {"status", "source", "seen"}; source is "ai" or
+    "correction". The whole store is dropped when corrections.json changes.
+    """
+
+    def __init__(self, path, max_entries=DISH_CACHE_MAX_ENTRIES, ttl_days=DISH_CACHE_TTL_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 86400
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.fingerprint = corrections_fingerprint()
+        self.entries = OrderedDict()
+        try:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("corrections") == self.fingerprint:
+                    self.entries = OrderedDict(data.get("entries", {}))
+                else:
+                    print("🧹 corrections.json changed - dish verdict cache cleared")
+                    self.dirty = True
+        except:
+            pass
+
+    def get(self, dish):
+        """Cached status for a dish, or None (expired entries count as missing)."""
+        now = time.time()
+        with self.lock:
+            for key in dish_keys(dish):
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if now - entry.get("seen", 0) > self.ttl_seconds:
+                    del self.entries[key]
+                    self.dirty = True
+                    continue
+                self.entries.move_to_end(key)
+                if now - entry.get("seen", 0) > DISH_CACHE_TOUCH_DAYS * 86400:
+                    entry["seen"] = now  # coarse, so repeat hits don't rewrite the file every run
+                    self.dirty = True
+                metrics.count("dish_cache.hit")
+                return entry["status"]
+        metrics.count("dish_cache.miss")
         return None
 
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-3-flash-preview')
-    
-    # Load manual corrections
+    def put(self, dish, status, source):
+        """Record a verdict under every key of the dish name, evicting least recently seen."""
+        if status == UNKNOWN or not isinstance(dish, str) or SCHEMA_PLACEHOLDER.match(dish.strip()):
+            return
+        now = time.time()
+        with self.lock:
+            for key in dish_keys(dish):
+                self.entries[key] = {"status": status, "source": source, "seen": now}
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def learn(self, analysis, scope=None):
+        """Record the dish verdicts of a Gemini analysis, only for the cafeterias and meals in scope."""
+        for cafe in analysis.get("cafeterias", []):
+            name = cafe.get("name")
+            if scope is not None and name not in scope:
+                continue
+            if cafe.get("type") == "individual":
+                for dish in cafe.get("safe_options", []):
+                    self.put(dish, PORK_FREE, "ai")
+                for dish in cafe.get("avoid", []):
+                    self.put(dish, PORK, "ai")
+                continue
+            for meal in cafe.get("meals", []):
+                if scope is not None and scope[name] is not None and meal.get("time") not in scope[name]:
+                    continue
+                for dish in meal.get("safe_items", []):
+                    self.put(dish, PORK_FREE, "ai")
+                for dish in meal.get("skip_items", []):
+                    self.put(dish, PORK, "ai")
+                if meal.get("verdict") == "NOT WORTH" and meal.get("main_dish"):
+                    self.put(meal["main_dish"], PORK, "ai")
+
+    def save(self):
+        """Write the store back if anything changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {"corrections": self.fingerprint, "entries": dict(self.entries)}
+            atomic_write_json(self.path, data)
+            self.dirty = False
+
+_dish_cache = None
+
+def get_dish_cache():
+    """Process-wide dish verdict cache (reloaded when corrections.json changes)."""
+    global _dish_cache
+    if _dish_cache is None or _dish_cache.path != DISH_CACHE_FILE or _dish_cache.fingerprint != corrections_fingerprint():
+        _dish_cache = DishVerdictCache(DISH_CACHE_FILE)
+    return _dish_cache
+
+# --- LOCAL PORK RULES ---
+PORK = "pork"
+SUSPICIOUS = "suspicious"
+PORK_FREE = "pork-free"
+UNKNOWN = "unknown"
+
+# Same lists as PORK DETECTION RULES in the prompt, plus the Korean names used on the menu pages.
+# Pork and suspicious keywords match anywhere in a dish name.
+PORK_KEYWORDS = [
+    "돼지", "돈육", "돈까스", "돈가스", "돈카츠", "제육", "햄", "베이컨", "소시지", "소세지", "스팸",
+    "만두", "부대찌개", "감자탕", "뼈해장국", "순대", "삼겹", "목살", "보쌈", "족발", "탕수육",
+    "동그랑땡", "멘치", "마파두부", "동파육", "등갈비",
+    "pork", "ham", "bacon", "sausage", "spam", "tonkatsu", "donkatsu", "mandu", "dumpling",
+    "dumplings", "budae", "gamjatang", "jeyuk", "menchi", "bossam", "jokbal", "samgyeopsal"
+]
+SUSPICIOUS_KEYWORDS = [
+    "라면", "김치찌개", "순두부", "카레", "짬뽕", "짜장", "잡채", "불고기", "찌개", "미트볼",
+    "김치볶음밥", "카츠",
+    "ramen", "curry", "kimchi stew", "soft tofu stew", "jjigae", "sundubu", "jjamppong",
+    "japchae", "bulgogi", "meatball"
+]
+# Pork-free needs the whole dish name: 김치 alone is safe, 김치찜 or 두부김치 usually aren't.
+# Anything else goes to Gemini once and is remembered in the dish cache.
+PORK_FREE_DISHES = [
+    "밥", "쌀밥", "백미밥", "잡곡밥", "흑미밥", "현미밥", "보리밥", "기장밥", "차조밥", "수수밥", "찰밥",
+    "공기밥", "공깃밥", "추가밥",
+    "김치", "배추김치", "포기김치", "맛김치", "총각김치", "열무김치", "백김치", "물김치", "나박김치",
+    "동치미", "깍두기", "석박지", "오이소박이", "단무지", "피클", "오이피클", "할라피뇨",
+    "우유", "요구르트", "요플레", "주스", "과일", "계절과일", "바나나", "사과", "귤", "식혜", "수정과",
+    "rice", "steamed rice", "white rice", "kimchi", "cabbage kimchi", "pickled radish", "pickles",
+    "fruit", "milk", "yogurt", "juice"
+]
+# The staples above (rice, kimchi, pickles, drinks) are never the main dish of a package meal, nor is the soup
+SOUP_PATTERN = re.compile(r"(국|탕|찌개|전골|스프|수프|soup|stew)$", re.IGNORECASE)
+MEAL_TIMES = {"조식": "Breakfast", "중식": "Lunch", "석식": "Dinner",
+              "breakfast": "Breakfast", "lunch": "Lunch", "dinner": "Dinner"}
+PACKAGE_TIMES = ["Breakfast", "Lunch", "Dinner"]
+CAFETERIA_TYPES = {"A La Carte": "individual"}  # everything else is a package meal
+
+CORRECTION_STATUS = {"unsafe": PORK, "suspicious": SUSPICIOUS, "safe": PORK_FREE}
+
+def _dish_pattern(names):
+    """Alternation regex meant for fullmatch() against a normalized dish name."""
+    return re.compile("|".join(re.escape(name) for name in sorted(set(names), key=len, reverse=True)), re.IGNORECASE)
+
+def _matches_whole(pattern, dish):
+    """True if pattern covers the whole dish name (any of its dish_keys, with or without spaces)."""
+    return any(pattern.fullmatch(key) or pattern.fullmatch(key.replace(" ", "")) for key in dish_keys(dish))
+
+def _keyword_pattern(keywords):
+    """One alternation regex; English words need word boundaries, Korean matches inside words."""
+    parts = []
+    for word in sorted(set(keywords), key=len, reverse=True):
+        escaped = re.escape(word)
+        parts.append(rf"\b{escaped}\b" if word.isascii() else escaped)
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+_rule_index = None
+_rule_index_key = None
+
+def get_rule_index():
+    """Compiled keyword index, rebuilt only when corrections.json changes."""
+    global _rule_index, _rule_index_key
+    corrections = load_corrections()
+    key = corrections_fingerprint()
+    if _rule_index is None or key != _rule_index_key:
+        # Corrections override the built-in lists; the longest matching dish wins.
+        # Like the built-in list, a "safe" correction must name the whole dish.
+        ordered = sorted(corrections, key=lambda corr: len(corr.get("dish", "")), reverse=True)
+        entries = []
+        for corr in ordered:
+            if not corr.get("dish"):
+                continue
+            status = CORRECTION_STATUS.get(corr.get("status", "").lower(), SUSPICIOUS)
+            if status == PORK_FREE:
+                entries.append((_dish_pattern(dish_keys(corr["dish"])), status, True))
+            else:
+                entries.append((_keyword_pattern([corr["dish"]]), status, False))
+        _rule_index = {
+            "corrections": entries,
+            PORK: _keyword_pattern(PORK_KEYWORDS),
+            SUSPICIOUS: _keyword_pattern(SUSPICIOUS_KEYWORDS),
+            PORK_FREE: _dish_pattern(PORK_FREE_DISHES)
+        }
+        _rule_index_key = key
+    return _rule_index
+
+def classify_dish_source(dish, index=None, dish_cache=None):
+    """Classify one dish; returns (status, source) with source "correction", "rules", "cache" or None."""
+    index = index or get_rule_index()
+    for pattern, status, whole in index["corrections"]:
+        if _matches_whole(pattern, dish) if whole else pattern.search(dish):
+            return status, "correction"
+    for status in (PORK, SUSPICIOUS):
+        if index[status].search(dish):
+            return status, "rules"
+    if _matches_whole(index[PORK_FREE], dish):
+        return PORK_FREE, "rules"
+    cached = (dish_cache or get_dish_cache()).get(dish)
+    if cached:
+        return cached, "cache"
+    return UNKNOWN, None
+
+def classify_dish(dish, index=None):
+    """Classify one dish name as pork / suspicious / pork-free / unknown."""
+    return classify_dish_source(dish, index)[0]
+
+def meal_time(label):
+    """Map a table row label like "중식" to the Breakfast/Lunch/Dinner names used in verdicts."""
+    label = label.strip()
+    for prefix, time_name in MEAL_TIMES.items():
+        if label.lower().startswith(prefix):
+            return time_name
+    return label
+
+def main_dish_of(dishes):
+    """Likely main dish of a package meal: the first one that isn't a staple or soup."""
+    staples = get_rule_index()[PORK_FREE]
+    sides = [dish for dish in dishes if not _matches_whole(staples, dish)]
+    return next((dish for dish in sides if not SOUP_PATTERN.search(dish)), sides[0] if sides else dishes[0])
+
+def _local_package_meal(time_name, dishes, statuses):
+    """Verdict for one package meal whose dishes are all classified.
+
+    Returns None when the rules can't be sure: a pork dish next to a pork-free
+    "main" may mean we picked the wrong main, so WORTH IT is left to Gemini,
+    and a suspicious main (불고기, 카츠) is often beef or chicken. Only a
+    pork main is NOT WORTH locally.
+    """
+    if not dishes:
+        return {"time": time_name, "verdict": "NONE", "main_dish": "", "safe_items": [],
+                "skip_items": [], "reason": "No meal available."}
+    main_dish = main_dish_of(dishes)
+    safe_items = [dish for dish in dishes if statuses[dish] == PORK_FREE]
+    skip_items = [dish for dish in dishes if statuses[dish] != PORK_FREE]
+    if not skip_items:
+        verdict, reason = "SAFE", "All items are pork-free (local rules)."
+    elif statuses[main_dish] == PORK:
+        verdict, reason = "NOT WORTH", f"Main dish {main_dish} is {statuses[main_dish]} (local rules)."
+    else:
+        return None
+    return {"time": time_name, "verdict": verdict, "main_dish": main_dish, "safe_items": safe_items,
+            "skip_items": skip_items, "reason": reason}
+
+def classify_day(menus, target_day, cafeterias=None):
+    """Build a day's verdict JSON locally.
+
+    Returns (analysis, unknown) where unknown maps each cafeteria that still
+    needs Gemini to the set of meal row labels with unclassified dishes (None
+    means the whole cafeteria). Those meals are NONE placeholders in analysis.
+    """
+    index = get_rule_index()
+    dish_cache = get_dish_cache()
+    analysis = {"day": target_day, "cafeterias": []}
+    unknown = {}
+    for name, menu in menus.items():
+        if cafeterias is not None and name not in cafeterias:
+            continue
+        cafe_type = CAFETERIA_TYPES.get(name, "package")
+        table = menu.get("table")
+        if table is None or not table.day_columns:
+            unknown[name] = None
+            rows = []
+        else:
+            rows = [(label, list(dishes)) for label, dishes in table.dishes(target_day)]
+        statuses = {}
+        for _, dishes in rows:
+            for dish in dishes:
+                statuses[dish], source = classify_dish_source(dish, index, dish_cache)
+                if source == "correction":
+                    dish_cache.put(dish, statuses[dish], "correction")
+        
+        if cafe_type == "individual":
+            dishes = [dish for _, row_dishes in rows for dish in row_dishes]
+            if any(statuses[dish] == UNKNOWN for dish in dishes):
+                unknown[name] = None
+            analysis["cafeterias"].append({
+                "name": name,
+                "type": "individual",
+                "safe_options": [dish for dish in dishes if statuses[dish] == PORK_FREE],
+                "avoid": [dish for dish in dishes if statuses[dish] in (PORK, SUSPICIOUS)]
+            })
+            continue
+        
+        # Rows that map to the same meal time (e.g. two lunch lines) form one meal
+        by_time = {}
+        labels_by_time = {}
+        for label, dishes in rows:
+            time_name = meal_time(label)
+            by_time.setdefault(time_name, []).extend(dishes)
+            labels_by_time.setdefault(time_name, set()).add(label)
+        meals = []
+        for time_name in PACKAGE_TIMES + [t for t in by_time if t not in PACKAGE_TIMES]:
+            dishes = by_time.get(time_name, [])
+            meal = None if any(statuses[dish] == UNKNOWN for dish in dishes) else _local_package_meal(time_name, dishes, statuses)
+            if meal is None:
+                if unknown.get(name, set()) is not None:
+                    unknown.setdefault(name, set()).update(labels_by_time[time_name])
+                meal = _local_package_meal(time_name, [], statuses)
+            meals.append(meal)
+        analysis["cafeterias"].append({"name": name, "type": "package", "meals": meals})
+    return analysis, unknown
+
+def merge_ai_verdicts(local, ai, unknown):
+    """Fill the meals classify_day() couldn't decide with Gemini's verdicts."""
+    ai_cafes = {cafe.get("name"): cafe for cafe in ai.get("cafeterias", [])}
+    merged = {"day": local.get("day"), "cafeterias": []}
+    for cafe in local["cafeterias"]:
+        name = cafe["name"]
+        ai_cafe = ai_cafes.get(name)
+        if name not in unknown or ai_cafe is None:
+            merged["cafeterias"].append(cafe)
+        elif unknown[name] is None or cafe["type"] != "package":
+            merged["cafeterias"].append(ai_cafe)
+        else:
+            times = {meal_time(label) for label in unknown[name]}
+            ai_meals = {meal.get("time"): meal for meal in ai_cafe.get("meals", [])}
+            meals = [ai_meals.get(meal["time"], meal) if meal["time"] in times else meal for meal in cafe["meals"]]
+            merged["cafeterias"].append(dict(cafe, meals=meals))
+    return merged
+
+# --- AI ANALYSIS ---
+def build_corrections_text():
+    """Format corrections.json entries for the prompt."""
     corrections = load_corrections()
     corrections_text = ""
     if corrections:
         corrections_text = "\n\nMANUAL CORRECTIONS (OVERRIDE AI):\n"
         for corr in corrections:
             corrections_text += f"- {corr['dish']} at {corr['cafeteria']}: {corr['status'].upper()} - {corr['reason']}\n"
+    return corrections_text
 
-    prompt = f"""
-You are a PORK-FREE food assistant for foreign students in Korea who don't eat pork.
+_rules_text = {}  # corrections fingerprint -> rules block
 
-IMPORTANT: We are checking for PORK only, not full halal certification. 
-This is a PORK-FREE guide, not halal certification.
-
-TARGET DAY: {target_day}
+def build_rules_text():
+    """Context + pork rules + worthiness block shared by every prompt (rebuilt when corrections change)."""
+    fingerprint = corrections_fingerprint()
+    if fingerprint not in _rules_text:
+        _rules_text.clear()
+        _rules_text[fingerprint] = _render_rules_text()
+    return _rules_text[fingerprint]
 
+def _render_rules_text():
+    return f"""
 CONTEXT:
 - Student & Professor Cafeteria = PACKAGE MEAL (you get everything, cannot choose individual items)
 - A La Carte = INDIVIDUAL ORDER (you can pick specific safe dishes)
@@ -159,73 +1074,813 @@ PORK DETECTION RULES:
 - CONTAINS PORK: Pork, Ham, Bacon, Sausage, Spam, Tonkatsu/Donkatsu, Mandu/Dumplings (usually pork), Budae-jjigae, Gamjatang, Jeyuk, Menchi Katsu
 - PORK-FREE: Chicken, Beef, Fish, Seafood, Tofu, Eggs, Vegetables
 - SUSPICIOUS (may contain pork): Ramen (pork broth), Kimchi Stew, Soft Tofu Stew, Curry (often contains pork in Korea)
-{corrections_text}
+{build_corrections_text()}
 PACKAGE MEAL WORTHINESS:
 - SAFE = All items are pork-free
 - WORTH IT = Main dish is pork-free, but some side dishes contain pork (can skip those sides)
 - NOT WORTH = Main dish contains pork (don't buy this package)
 - NONE = No meal available
+"""
 
-MENU DATA:
-{menu_data}
+# A scope says what Gemini was asked for: {cafeteria: meal times, or None for every meal}.
+# None as the whole scope means every cafeteria and meal.
+def analysis_scope(unknown):
+    """Scope of classify_day()'s unknown map (meal row labels become meal times)."""
+    return {name: None if labels is None else {meal_time(label) for label in labels}
+            for name, labels in unknown.items()}
 
-Return ONLY this JSON (no markdown):
-{{
-  "day": "{target_day}",
-  "cafeterias": [
-    {{
-      "name": "Student Cafeteria",
-      "type": "package",
-      "meals": [
-        {{
-          "time": "Breakfast",
+def union_scope(scopes):
+    """Smallest scope covering all of scopes (None if any of them is None)."""
+    scopes = list(scopes)
+    if not scopes or None in scopes:
+        return None
+    union = {}
+    for scope in scopes:
+        for name, times in scope.items():
+            union[name] = None if times is None or union.get(name, set()) is None else union.get(name, set()) | times
+    return union
+
+def scope_cafeterias(scope):
+    return [name for name in URLS if scope is None or name in scope]
+
+def scope_times(scope, name):
+    """Package meal times Gemini must answer for a cafeteria."""
+    times = None if scope is None else scope.get(name)
+    return [t for t in PACKAGE_TIMES if times is None or t in times] or PACKAGE_TIMES
+
+_day_schemas = {}
+
+def build_day_schema(target_day, scope=None):
+    """JSON shape of one day's verdicts for the cafeterias and meals in scope (cached)."""
+    key = (target_day, tuple((name, tuple(scope_times(scope, name))) for name in scope_cafeterias(scope)))
+    if key not in _day_schemas:
+        _day_schemas[key] = _render_day_schema(target_day, scope)
+    return _day_schemas[key]
+
+def _render_day_schema(target_day, scope=None):
+    blocks = []
+    detailed = True  # spell out the first meal, abbreviate the rest
+    for name in scope_cafeterias(scope):
+        if CAFETERIA_TYPES.get(name, "package") == "individual":
+            blocks.append(f"""    {{
+      "name": "{name}",
+      "type": "individual",
+      "safe_options": ["Dish Name 1", "Dish Name 2"],
+      "avoid": ["Dish Name 3", "Dish Name 4"]
+    }}""")
+            continue
+        meals = []
+        for time_name in scope_times(scope, name):
+            if detailed:
+                meals.append(f"""        {{
+          "time": "{time_name}",
           "verdict": "SAFE/WORTH IT/NOT WORTH/NONE",
           "main_dish": "name of main protein/dish",
           "safe_items": ["list items you can eat"],
           "skip_items": ["list items with pork to skip"],
           "reason": "brief explanation"
-        }},
-        {{"time": "Lunch", "verdict": "...", "main_dish": "...", "safe_items": [], "skip_items": [], "reason": "..."}},
-        {{"time": "Dinner", "verdict": "...", "main_dish": "...", "safe_items": [], "skip_items": [], "reason": "..."}}
-      ]
-    }},
-    {{
-      "name": "Professor Cafeteria",
+        }}""")
+                detailed = False
+            else:
+                meals.append(f"""        {{"time": "{time_name}", "verdict": "...", "main_dish": "...", "safe_items": [], "skip_items": [], "reason": "..."}}""")
+        meal_lines = ",\n".join(meals)
+        blocks.append(f"""    {{
+      "name": "{name}",
       "type": "package",
       "meals": [
-        {{"time": "Breakfast", "verdict": "...", "main_dish": "...", "safe_items": [], "skip_items": [], "reason": "..."}},
-        {{"time": "Lunch", "verdict": "...", "main_dish": "...", "safe_items": [], "skip_items": [], "reason": "..."}},
-        {{"time": "Dinner", "verdict": "...", "main_dish": "...", "safe_items": [], "skip_items": [], "reason": "..."}}
+{meal_lines}
       ]
-    }},
-    {{
-      "name": "A La Carte",
-      "type": "individual",
-      "safe_options": ["Dish Name 1", "Dish Name 2"],
-      "avoid": ["Dish Name 3", "Dish Name 4"]
-    }}
+    }}""")
+    cafeteria_lines = ",\n".join(blocks)
+    return f"""{{
+  "day": "{target_day}",
+  "cafeterias": [
+{cafeteria_lines}
   ]
-}}
+}}"""
 
-IMPORTANT: For A La Carte, safe_options and avoid MUST be simple string arrays of dish names only.
+PROMPT_INTRO = """
+You are a PORK-FREE food assistant for foreign students in Korea who don't eat pork.
+
+IMPORTANT: We are checking for PORK only, not full halal certification. 
+This is a PORK-FREE guide, not halal certification.
+"""
+
+ALA_CARTE_NOTE = """IMPORTANT: For A La Carte, safe_options and avoid MUST be simple string arrays of dish names only.
 Do NOT use objects/dicts. Just plain strings like: ["Chicken Steak", "Beef Soup"]
 """
+
+def build_prompt(menu_data, target_day, scope=None):
+    """Prompt for a single day's analysis (only the cafeterias and meals in scope)."""
+    return f"""{PROMPT_INTRO}
+TARGET DAY: {target_day}
+{build_rules_text()}
+MENU DATA:
+{menu_data}
+
+Return ONLY this JSON (no markdown):
+{build_day_schema(target_day, scope)}
+
+{ALA_CARTE_NOTE}"""
+
+def build_week_prompt(menu_data, target_days, scope=None):
+    """Prompt asking for every target day in one structured response."""
+    return f"""{PROMPT_INTRO}
+TARGET DAYS: {", ".join(target_days)}
+{build_rules_text()}
+MENU DATA:
+{menu_data}
+
+Return ONLY this JSON (no markdown), with one entry in "days" per TARGET DAY, in the same order.
+Each entry has exactly this shape (shown for {target_days[0]}):
+{{"days": [
+{build_day_schema(target_days[0], scope)},
+...
+]}}
+
+{ALA_CARTE_NOTE}"""
+
+def get_model():
+    """Configured Gemini model."""
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+# --- GEMINI RATE LIMITING ---
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "5"))
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "15"))
+GEMINI_RETRIES = 3
+GEMINI_BACKOFF_SECONDS = 2.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# --- PROMPT SIZE BUDGET ---
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", "8000"))          # per prompt
+MAX_RUN_PROMPT_TOKENS = int(os.getenv("MAX_RUN_PROMPT_TOKENS", "0"))     # per analyze_menus run, 0 = no cap
+_prompt_stats_lock = threading.Lock()
+
+def estimate_tokens(text):
+    """Rough input token count: ~1 per Hangul syllable, ~4 characters per token otherwise."""
+    hangul = len(HANGUL.findall(text))
+    return hangul + (len(text) - hangul + 3) // 4
+
+def check_prompt_budget(prompt, run=None):
+    """Count a prompt against the caps; raises RuntimeError instead of sending an oversized one.
+
+    run is the analyze_menus run (from TokenLedger.start_run) the prompt belongs to.
+    """
+    tokens = estimate_tokens(prompt)
+    run = run if run is not None else {"prompts": 0, "estimated_tokens": 0}
+    with _prompt_stats_lock:
+        if tokens > MAX_PROMPT_TOKENS:
+            raise RuntimeError(f"prompt ~{tokens} tokens exceeds MAX_PROMPT_TOKENS={MAX_PROMPT_TOKENS}")
+        if MAX_RUN_PROMPT_TOKENS and run["estimated_tokens"] + tokens > MAX_RUN_PROMPT_TOKENS:
+            raise RuntimeError(f"run prompt budget of ~{MAX_RUN_PROMPT_TOKENS} tokens used up")
+        run["prompts"] += 1
+        run["estimated_tokens"] += tokens
+        total = run["estimated_tokens"]
+    print(f"   📏 Prompt ~{tokens} tokens (run total ~{total})")
+    return tokens
+
+# --- TOKEN ACCOUNTING ---
+GEMINI_DAILY_TOKEN_BUDGET = int(os.getenv("GEMINI_DAILY_TOKEN_BUDGET", "0"))  # prompt + output tokens per day, 0 = no cap
+TOKEN_USAGE_KEEP_DAYS = 31
+TOKEN_USAGE_KEEP_RUNS = 50
+
+class TokenLedger:
+    """Gemini token usage per calendar day, per analyzed menu day and per run.
+
+    Persisted to TOKEN_USAGE_FILE, which the bot and morning_scrape.py share:
+    the file is re-read whenever another process changed it, and this
+    process's unsaved calls are merged into a fresh copy on save.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.disk = None
+        self.mtime = None
+        self.pending = []       # (date, prompt_tokens, output_tokens, target_days) not on disk yet
+        self.pending_runs = []
+
+    def _read(self):
+        """The file's contents, re-read only when its mtime changed."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self.disk is None or mtime != self.mtime:
+            self.disk = {"days": {}, "runs": []}
+            try:
+                if mtime is not None:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self.disk = json.load(f)
+            except:
+                pass
+            self.mtime = mtime
+        return self.disk
+
+    def load(self):
+        """Usage on disk plus this process's unsaved calls and runs."""
+        with self.lock:
+            data = copy.deepcopy(self._read())
+            days = data.setdefault("days", {})
+            for date, prompt_tokens, output_tokens, target_days in self.pending:
+                self._add(days.setdefault(date, self._bucket()), prompt_tokens, output_tokens, target_days)
+            runs = data.setdefault("runs", [])
+            runs.extend(copy.deepcopy(self.pending_runs))
+            del runs[:-TOKEN_USAGE_KEEP_RUNS]
+            return data
+
+    @staticmethod
+    def _bucket():
+        return {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "by_day": {}}
+
+    @staticmethod
+    def _add(bucket, prompt_tokens, output_tokens, target_days):
+        """Book one call into a bucket, splitting its tokens evenly over target_days."""
+        target_days = target_days or ["(unknown)"]
+        share = (prompt_tokens + output_tokens) // len(target_days)
+        bucket["calls"] += 1
+        bucket["prompt_tokens"] += prompt_tokens
+        bucket["output_tokens"] += output_tokens
+        for day in target_days:
+            bucket["by_day"][day] = bucket["by_day"].get(day, 0) + share
+
+    def today(self):
+        return self.load()["days"].get(datetime.now().date().isoformat(), self._bucket())
+
+    def used_today(self):
+        today = self.today()
+        return today["prompt_tokens"] + today["output_tokens"]
+
+    def exhausted(self):
+        return bool(GEMINI_DAILY_TOKEN_BUDGET) and self.used_today() >= GEMINI_DAILY_TOKEN_BUDGET
+
+    def start_run(self):
+        """A new run record; pass it along the analysis calls that belong to it."""
+        return dict(self._bucket(), started_at=datetime.now().isoformat(), prompts=0, estimated_tokens=0)
+
+    def record(self, prompt_tokens, output_tokens, target_days=None, run=None):
+        """Add one call's tokens to today and, if given, to its run."""
+        with self.lock:
+            self.pending.append((datetime.now().date().isoformat(), prompt_tokens, output_tokens, list(target_days or [])))
+            if run is not None:
+                self._add(run, prompt_tokens, output_tokens, target_days)
+
+    def finish_run(self, run):
+        """Close a run and save; returns its totals (None if it made no calls)."""
+        if not run or not run["calls"]:
+            return None
+        with self.lock:
+            self.pending_runs.append(run)
+            self.save()
+        return run
+
+    def save(self):
+        """Merge the unsaved calls into the file as it is now and write it back."""
+        with self.lock:
+            if not self.pending and not self.pending_runs:
+                return
+            self.disk = None  # always start from the latest file
+            data = self.load()
+            for old in sorted(data["days"])[:-TOKEN_USAGE_KEEP_DAYS]:
+                del data["days"][old]
+            atomic_write_json(self.path, data, indent=2)
+            self.pending, self.pending_runs = [], []
+            self.disk, self.mtime = data, os.stat(self.path).st_mtime_ns
+
+_token_ledger = None
+
+def get_token_ledger():
+    """Process-wide TokenLedger for TOKEN_USAGE_FILE."""
+    global _token_ledger
+    if _token_ledger is None or _token_ledger.path != TOKEN_USAGE_FILE:
+        _token_ledger = TokenLedger(TOKEN_USAGE_FILE)
+    return _token_ledger
+
+# --- RESPONSE STORE ---
+RESPONSE_STORE_MAX_BYTES = int(float(os.getenv("RESPONSE_STORE_MAX_MB", "5")) * 1024 * 1024)
+GEMINI_REPLAY = os.getenv("GEMINI_REPLAY", "0") not in ("", "0")  # answer only from the store, never call Gemini
+
+def prompt_key(prompt, model=None):
+    """sha256 of the model name and the fully built prompt."""
+    return hashlib.sha256(f"{model or GEMINI_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+
+class StoredResponse:
+    """A Gemini reply served from the response store (no tokens spent)."""
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+class ResponseStore:
+    """Gemini replies on disk, one <prompt_key>.json per prompt, evicted least recently used.
+
+    Hits bump the file's mtime, so eviction order survives restarts and is
+    shared by every process (bot, morning scrape) using the same directory.
+    """
+
+    def __init__(self, directory, max_bytes=RESPONSE_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, prompt):
+        """Stored reply text for a prompt, or None."""
+        path = self.path(prompt_key(prompt))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f)["text"]
+            os.utime(path)
+        except:
+            metrics.count("response_store.miss")
+            return None
+        metrics.count("response_store.hit")
+        return text
+
+    def put(self, prompt, text):
+        """Store a reply, then evict the least recently used ones above max_bytes."""
+        key = prompt_key(prompt)
+        entry = {"model": GEMINI_MODEL, "stored_at": datetime.now().isoformat(),
+                 "prompt_tokens": estimate_tokens(prompt), "text": text}
+        with self.lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                atomic_write_json(self.path(key), entry)
+                self.evict()
+            except Exception as e:
+                print(f"⚠️ Could not store Gemini reply: {e}")
+
+    def evict(self):
+        files = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".json") and not item.name.startswith(".tmp-"):
+                stat = item.stat()
+                files.append((stat.st_mtime, stat.st_size, item.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        # Always keep the newest reply, even if it alone is over the cap
+        for _, size, path in files[:-1]:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            metrics.count("response_store.evicted")
+
+_response_store = None
+
+def get_response_store():
+    """Process-wide ResponseStore for RESPONSE_STORE_DIR."""
+    global _response_store
+    if _response_store is None or _response_store.directory != RESPONSE_STORE_DIR:
+        _response_store = ResponseStore(RESPONSE_STORE_DIR)
+    return _response_store
+
+class RateLimiter:
+    """Token bucket: `rate` requests per minute with bursts of up to `burst`."""
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+gemini_limiter = RateLimiter(GEMINI_REQUESTS_PER_MINUTE, burst=GEMINI_MAX_IN_FLIGHT)
+
+def is_retryable(error):
+    """True for quota (429) and server-side (5xx) API errors."""
+    status = getattr(error, "code", None)
+    return isinstance(status, int) and status in RETRYABLE_STATUS
+
+def usage_tokens(response):
+    """(prompt_tokens, output_tokens) from a response's usage_metadata (0, 0 if absent)."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    read = (lambda key: usage.get(key)) if isinstance(usage, dict) else (lambda key: getattr(usage, key, None))
+    return int(read("prompt_token_count") or 0), int(read("candidates_token_count") or 0)
+
+def generate_content(prompt, target_days=None, run=None):
+    """Call Gemini through the rate limiter, retrying 429/5xx with jittered backoff.
+
+    A prompt already in the response store is answered from it for free,
+    unless the run is a forced refresh. Refuses to call once the daily token
+    budget is used up; every reply's tokens are booked to the ledger under
+    target_days (and to run, if given).
+    """
+    stored = get_response_store().get(prompt) if GEMINI_REPLAY or not (run or {}).get("force") else None
+    if stored is not None:
+        return StoredResponse(stored)
+    if GEMINI_REPLAY:
+        raise RuntimeError(f"GEMINI_REPLAY: no stored reply for prompt {prompt_key(prompt)[:12]}")
+    ledger = get_token_ledger()
+    if ledger.exhausted():
+        raise RuntimeError(f"daily Gemini token budget of {GEMINI_DAILY_TOKEN_BUDGET} used up")
+    check_prompt_budget(prompt, run)
+    model = get_model()
+    for attempt in range(GEMINI_RETRIES + 1):
+        gemini_limiter.acquire()
+        try:
+            metrics.count("gemini.calls")
+            with metrics.span("gemini.call"):
+                response = model.generate_content(prompt)
+            prompt_tokens, output_tokens = usage_tokens(response)
+            if not prompt_tokens:
+                # No usage_metadata: book our own estimate so the budget still holds
+                prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(getattr(response, "text", "") or "")
+            ledger.record(prompt_tokens, output_tokens, target_days, run)
+            metrics.count("gemini.tokens.prompt", prompt_tokens)
+            metrics.count("gemini.tokens.output", output_tokens)
+            return response
+        except Exception as e:
+            metrics.count("gemini.errors")
+            if attempt == GEMINI_RETRIES or not is_retryable(e):
+                raise
+            metrics.count("gemini.retries")
+            delay = random.uniform(0, GEMINI_BACKOFF_SECONDS * 2 ** attempt)
+            print(f"   ⚠️ Gemini {getattr(e, 'code', '')} - retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def generate_json(prompt, target_days=None, run=None, valid=None):
+    """Send a prompt and parse the JSON reply. Returns (data, complete).
+
+    A fresh reply is kept in the response store only if valid(data, complete)
+    accepts it, so truncated or unusable replies are asked again next time.
+    """
+    response = generate_content(prompt, target_days, run)
+    data, complete = extract_json(response.text)
+    if valid and not isinstance(response, StoredResponse) and valid(data, complete):
+        get_response_store().put(prompt, response.text)
+    return data, complete
+
+# --- RESPONSE REPAIR ---
+# Gemini replies are checked against the schema and fixed locally where we
+# can; only cafeterias that can't be fixed are asked for again.
+VERDICTS = ["SAFE", "WORTH IT", "NOT WORTH", "NONE"]
+PORK_VERDICTS = {"UNSAFE", "NOT SAFE", "PORK", "CONTAINS PORK"}
+EMPTY_VERDICTS = {"NA", "N A", "NO MEAL", "NO DATA"}
+VERDICT_WORDS = re.compile(r"NOT WORTH|WORTH IT|NOT SAFE|UNSAFE|SAFE|NONE")
+
+def _close_truncated(text):
+    """Cut a reply that stopped mid-JSON back to its last complete value and close the brackets."""
+    stack, cut = [], None
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            cut = (i + 1, list(stack))
+        elif ch in "}]" and stack:
+            stack.pop()
+            cut = (i + 1, list(stack))
+        elif ch == ",":
+            cut = (i, list(stack))
+    if cut is None:
+        return None
+    end, open_brackets = cut
+    return text[:end] + "".join(reversed(open_brackets))
+
+def extract_json(text):
+    """Parse the JSON in a model reply. Returns (data, complete).
+
+    Tries a plain json.loads first, then the first JSON value found after
+    any code fence or chatter (ignoring trailing text), and finally closes
+    a truncated reply (complete=False).
+    """
+    text = (text or "").strip()
     try:
-        response = model.generate_content(prompt)
-        cleaned_text = response.text.replace("```json", "").replace("```", "").strip()
-        result = json.loads(cleaned_text)
-        
-        # Fix any dict items in safe_options/avoid (fallback)
-        for cafe in result.get("cafeterias", []):
-            if cafe.get("type") == "individual":
-                # Convert dicts to strings if AI misbehaved
-                safe = cafe.get("safe_options", [])
-                cafe["safe_options"] = [item if isinstance(item, str) else item.get("menu", str(item)) for item in safe]
-                
-                avoid = cafe.get("avoid", [])
-                cafe["avoid"] = [item if isinstance(item, str) else item.get("menu", str(item)) for item in avoid]
-        
-        return result
+        return json.loads(text), True  # Fast path: a clean reply
+    except ValueError:
+        pass
+    
+    # Candidate starts: the first bracket, plus any line that begins with one
+    # (nested objects are indented, so they don't qualify)
+    starts = [i for i, ch in enumerate(text) if ch in "{[" and (i == 0 or text[i - 1] == "\n")]
+    first = min((text.find(ch) for ch in "{[" if ch in text), default=-1)
+    if first >= 0:
+        starts = sorted(set(starts) | {first})[:20]
+    
+    decoder = json.JSONDecoder()
+    for start in starts:
+        try:
+            return decoder.raw_decode(text, start)[0], True
+        except ValueError:
+            continue
+    for start in starts:
+        closed = _close_truncated(text[start:])
+        try:
+            return json.loads(closed), False
+        except (TypeError, ValueError):
+            continue
+    raise ValueError("No JSON found in Gemini reply")
+
+def normalize_verdict(value):
+    """Map the verdict spellings Gemini actually uses onto VERDICTS.
+
+    None if unrecognizable, empty, or naming several verdicts (an echoed
+    "SAFE/WORTH IT/NOT WORTH/NONE" or "..." placeholder from the schema).
+    """
+    text = re.sub(r"[^A-Z]+", " ", str(value or "").upper()).strip()
+    if not text or len(set(VERDICT_WORDS.findall(text))) > 1:
+        return None
+    if text.startswith("NOT WORTH") or text in PORK_VERDICTS:
+        return "NOT WORTH"
+    if text.startswith("WORTH"):
+        return "WORTH IT"
+    if text.startswith("SAFE"):
+        return "SAFE"
+    if text.startswith("NONE") or text in EMPTY_VERDICTS:
+        return "NONE"
+    return None
+
+def _as_text_list(items):
+    """List of plain dish names (dict items from a misbehaving reply become their name)."""
+    if isinstance(items, str):
+        items = [items]
+    if not isinstance(items, list):
+        return []
+    return [item if isinstance(item, str) else str(item.get("menu") or item.get("name") or item)
+            if isinstance(item, dict) else str(item) for item in items]
+
+def _repair_cafeteria(name, cafe, times=PACKAGE_TIMES):
+    """Schema-conforming copy of one cafeteria's verdicts, or None if it must be re-asked.
+
+    times are the package meals that were asked for; other meals in the
+    reply are kept when valid and dropped otherwise.
+    """
+    if CAFETERIA_TYPES.get(name, "package") == "individual":
+        return dict(cafe, name=name, type="individual",
+                    safe_options=_as_text_list(cafe.get("safe_options")),
+                    avoid=_as_text_list(cafe.get("avoid")))
+    
+    meals = cafe.get("meals")
+    if not isinstance(meals, list):
+        return None
+    by_time = {}
+    for meal in meals:
+        if not isinstance(meal, dict):
+            continue
+        time_name = MEAL_TIMES.get(str(meal.get("time", "")).strip().lower())
+        verdict = normalize_verdict(meal.get("verdict"))
+        if time_name is None or verdict is None:
+            if time_name in times:
+                return None
+            continue
+        by_time[time_name] = dict(meal, time=time_name, verdict=verdict,
+                                  main_dish=str(meal.get("main_dish") or ""),
+                                  safe_items=_as_text_list(meal.get("safe_items")),
+                                  skip_items=_as_text_list(meal.get("skip_items")),
+                                  reason=str(meal.get("reason") or ""))
+    if any(t not in by_time for t in times):
+        return None  # a left-out meal isn't "no meal"; re-ask rather than guess
+    return dict(cafe, name=name, type="package", meals=[by_time[t] for t in PACKAGE_TIMES if t in by_time])
+
+def repair_analysis(result, target_day, complete=True, scope=None):
+    """Validate and fix one day's verdicts. Returns (analysis, missing cafeteria names).
+
+    Only the cafeterias and meals in scope are required; cafeterias outside
+    it are dropped. A package cafeteria with a left-out meal slot counts as missing. In a truncated reply
+    (complete=False) the last cafeteria is where it was cut off, so it
+    counts as missing.
+    """
+    cafeterias = result.get("cafeterias") if isinstance(result, dict) else None
+    cafeterias = cafeterias if isinstance(cafeterias, list) else []
+    by_name = {}
+    for cafe in cafeterias if complete else cafeterias[:-1]:
+        if isinstance(cafe, dict):
+            by_name[str(cafe.get("name", "")).strip().lower()] = cafe
+    
+    repaired, missing = {}, []
+    for name in scope_cafeterias(scope):
+        cafe = by_name.get(name.lower())
+        fixed = _repair_cafeteria(name, cafe, scope_times(scope, name)) if cafe is not None else None
+        if fixed is None:
+            missing.append(name)
+        else:
+            repaired[name] = fixed
+    return {"day": target_day, "cafeterias": [repaired[name] for name in URLS if name in repaired]}, missing
+
+def build_fragment_prompt(menu_data, target_day, cafeterias, scope=None):
+    """Prompt asking only for the cafeterias a previous reply got wrong."""
+    return f"""
+You are a PORK-FREE food assistant for foreign students in Korea who don't eat pork.
+
+TARGET DAY: {target_day}
+ONLY THESE CAFETERIAS: {", ".join(cafeterias)}
+{build_rules_text()}
+MENU DATA:
+{menu_data}
+
+Return ONLY this JSON (no markdown): {{"cafeterias": [...]}} with one entry per cafeteria listed above,
+each shaped like the matching entry in:
+{build_day_schema(target_day, fragment_scope(scope, cafeterias))}
+
+{ALA_CARTE_NOTE}"""
+
+def fragment_scope(scope, cafeterias):
+    """The part of scope covering just these cafeterias."""
+    return {name: None if scope is None else scope.get(name) for name in cafeterias}
+
+def day_reply_ok(target_day, scope=None):
+    """Response store check: the reply is whole and everything in scope passes repair."""
+    return lambda data, complete: complete and not repair_analysis(data, target_day, True, scope)[1]
+
+def _fragment_cafeterias(data):
+    return data if isinstance(data, list) else data.get("cafeterias") if isinstance(data, dict) else None
+
+def complete_analysis(menu_data, target_day, result, complete=True, run=None, scope=None):
+    """Repair a day's reply; re-prompt just the broken cafeterias in scope. None if it can't be completed."""
+    analysis, missing = repair_analysis(result, target_day, complete, scope)
+    if not missing:
+        return analysis
+    if len(missing) == len(scope_cafeterias(scope)):
+        return None  # nothing usable; the caller's full retry is no more expensive
+    
+    print(f"   🩹 {target_day}: re-asking only for {', '.join(missing)}")
+    metrics.count("gemini.fragment_reprompts")
+    try:
+        sub_scope = fragment_scope(scope, missing)
+        fragment_ok = lambda data, complete: complete and not repair_analysis(
+            {"cafeterias": _fragment_cafeterias(data)}, target_day, True, sub_scope)[1]
+        data, fragment_complete = generate_json(build_fragment_prompt(menu_data, target_day, missing, scope), [target_day],
+                                                run, fragment_ok)
+    except Exception as e:
+        print(f"Error re-asking Gemini: {e}")
+        return None
+    fragment, still_missing = repair_analysis({"cafeterias": _fragment_cafeterias(data)}, target_day,
+                                              fragment_complete, sub_scope)
+    if still_missing:
+        return None
+    
+    by_name = {cafe["name"]: cafe for cafe in analysis["cafeterias"]}
+    by_name.update((cafe["name"], cafe) for cafe in fragment["cafeterias"])
+    analysis["cafeterias"] = [by_name[name] for name in scope_cafeterias(scope)]
+    return analysis
+
+@metrics.timed("gemini.analyze_day")
+def analyze_with_gemini(menu_data, target_day, run=None, scope=None):
+    """Sends menu text to Gemini to find pork-free options (for the cafeterias and meals in scope)."""
+    if not GEMINI_API_KEY and not GEMINI_REPLAY:
+        print("❌ Missing GEMINI_API_KEY")
+        return None
+
+    try:
+        result, complete = generate_json(build_prompt(menu_data, target_day, scope), [target_day], run,
+                                         day_reply_ok(target_day, scope))
+        return complete_analysis(menu_data, target_day, result, complete, run, scope)
     except Exception as e:
         print(f"Error analyzing with Gemini: {e}")
         return None
+
+def _week_entries(result):
+    entries = result.get("days", []) if isinstance(result, dict) else result
+    return entries if isinstance(entries, list) else []
+
+@metrics.timed("gemini.analyze_week")
+def analyze_week_with_gemini(menu_data, target_days, day_menus=None, run=None, scopes=None):
+    """One Gemini call for several days. Returns {day: analysis} for the days it could complete.
+
+    scopes optionally maps day -> scope; the prompt asks for their union.
+    """
+    scopes = scopes or {}
+    if not GEMINI_API_KEY and not GEMINI_REPLAY:
+        print("❌ Missing GEMINI_API_KEY")
+        return {}
+
+    def week_ok(data, complete):
+        by_day = {entry.get("day"): entry for entry in _week_entries(data) if isinstance(entry, dict)}
+        return complete and all(day in by_day and day_reply_ok(day, scopes.get(day))(by_day[day], True)
+                                for day in target_days)
+
+    try:
+        week_scope = union_scope(scopes.get(day) for day in target_days)
+        result, complete = generate_json(build_week_prompt(menu_data, target_days, week_scope), target_days, run, week_ok)
+    except Exception as e:
+        print(f"Error analyzing week with Gemini: {e}")
+        return {}
+    
+    week = {}
+    entries = _week_entries(result)
+    for i, entry in enumerate(entries):
+        day = entry.get("day") if isinstance(entry, dict) else None
+        if day in target_days and day not in week:
+            # Only the last entry of a truncated reply can be cut short
+            entry_complete = complete or i < len(entries) - 1
+            analysis = complete_analysis((day_menus or {}).get(day, menu_data), day, entry, entry_complete, run,
+                                         scopes.get(day))
+            if analysis:
+                week[day] = analysis
+    return week
+
+def analyze_days_parallel(menu_data, target_days, day_menus=None, max_in_flight=None, run=None, scopes=None):
+    """Per-day analyses run concurrently (bounded by max_in_flight and the rate limiter).
+
+    Returns {day: analysis} in target_days order; failed days are left out.
+    """
+    if not target_days:
+        return {}
+    workers = max(1, min(max_in_flight or GEMINI_MAX_IN_FLIGHT, len(target_days)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            day: pool.submit(analyze_with_gemini, (day_menus or {}).get(day, menu_data), day, run, (scopes or {}).get(day))
+            for day in target_days
+        }
+        results = {day: futures[day].result() for day in target_days}
+    return {day: result for day, result in results.items() if result}
+
+def analyze_week(menu_data, target_days, day_menus=None, run=None, scopes=None):
+    """Batched analysis of target_days, falling back to per-day calls for missing days.
+
+    day_menus optionally maps day -> smaller menu text for the per-day fallback,
+    scopes maps day -> the cafeterias and meals to ask for (default everything).
+    """
+    if not target_days:
+        return {}
+    week = analyze_week_with_gemini(menu_data, target_days, day_menus, run, scopes) if len(target_days) > 1 else {}
+    missing = [day for day in target_days if day not in week]
+    if week and missing:
+        print(f"   ⚠️ Batched reply incomplete, re-asking for {', '.join(missing)}")
+    week.update(analyze_days_parallel(menu_data, missing, day_menus, run=run, scopes=scopes))
+    return {day: week[day] for day in target_days if day in week}
+
+@metrics.timed("analyze.run")
+def analyze_menus(menus, target_days, cafeterias=None, force=False, run=None):
+    """Local rules first, then one batched Gemini call for whatever they can't decide.
+
+    cafeterias optionally maps day -> cafeteria names to analyze (default all).
+    force skips the response store and asks Gemini again (forced /refresh).
+    run is the caller's TokenLedger.start_run() record to count this call in;
+    a fresh one is started if not given.
+    Returns {day: analysis} in target_days order; days whose Gemini part
+    failed are left out so callers can keep their old verdicts.
+    """
+    ledger = get_token_ledger()
+    if run is None:
+        run = ledger.start_run()  # per call: concurrent refreshes keep separate totals
+    if force:
+        run["force"] = True
+    results = {}
+    pending = {}
+    for day in target_days:
+        local, unknown = classify_day(menus, day, (cafeterias or {}).get(day))
+        if unknown:
+            pending[day] = (local, unknown)
+        else:
+            results[day] = local
+    
+    if results:
+        print(f"   🧮 Decided locally (no API call): {', '.join(results)}")
+    if pending and ledger.exhausted():
+        # Out of budget: callers keep their cached verdicts for these days
+        print(f"   💸 Daily Gemini token budget ({GEMINI_DAILY_TOKEN_BUDGET}) used up, skipping {', '.join(pending)}")
+        pending = {}
+    if pending:
+        ai_cafes = [name for name in menus if any(name in unknown for _, unknown in pending.values())]
+        ai_meals = {}
+        for name in ai_cafes:
+            labels = [unknown.get(name, set()) for _, unknown in pending.values()]
+            ai_meals[name] = None if None in labels else set().union(*labels)
+        day_menus = {
+            day: get_day_menu_text(menus, day, list(unknown), unknown)
+            for day, (_, unknown) in pending.items()
+        }
+        week_menu = get_day_menu_text(menus, list(pending), ai_cafes, ai_meals)
+        scopes = {day: analysis_scope(unknown) for day, (_, unknown) in pending.items()}
+        ai_results = analyze_week(week_menu, list(pending), day_menus, run, scopes)
+        for day, (local, unknown) in pending.items():
+            if day in ai_results:
+                # Only the slices Gemini was shown; anything else in the reply is guesswork
+                get_dish_cache().learn(ai_results[day], scopes[day])
+                results[day] = merge_ai_verdicts(local, ai_results[day], unknown)
+        print(f"   📏 {run['prompts']} prompt(s), ~{run['estimated_tokens']} input tokens this run")
+    if ledger.finish_run(run):
+        budget = f" / {GEMINI_DAILY_TOKEN_BUDGET}" if GEMINI_DAILY_TOKEN_BUDGET else ""
+        print(f"   💰 Gemini tokens this run: {run['prompt_tokens']} in + {run['output_tokens']} out "
+              f"(today {ledger.used_today()}{budget})")
+    get_dish_cache().save()
+    return {day: results[day] for day in target_days if day in results}
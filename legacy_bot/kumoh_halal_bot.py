@@ -1,20 +1,36 @@
+import asyncio
+import json
 import requests
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import halal_lib  # Import shared library
+from telegram_sender import TelegramSender
 
 # Load environment variables
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")  # overridable for load tests
+
+# Freshness policy: commands read the cache, the refresher re-validates the menu
+MENU_REFRESH_MINUTES = float(os.getenv("MENU_REFRESH_MINUTES", "60"))
+REFRESH_DEBOUNCE_SECONDS = 120
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
 
 def get_day_name(offset=0):
     """Returns day name with offset (0=today, 1=tomorrow)."""
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
     target = datetime.now() + timedelta(days=offset)
-    return days[target.weekday()]
+    return DAY_NAMES[target.weekday()]
+
+def get_day_index(day):
+    """Position of a day name in the week (Monday=0)."""
+    return DAY_NAMES.index(day)
 
 # --- MESSAGE FORMATTING ---
 def format_message(analysis, is_tomorrow=False):
@@ -85,70 +101,189 @@ def format_message(analysis, is_tomorrow=False):
     
     return msg
 
+def format_week_line(day, analysis):
+    """One line of the /week overview for a day."""
+    status_summary = []
+    for cafe in analysis.get("cafeterias", []):
+        if cafe.get("type") == "individual":
+            safe = cafe.get("safe_options", [])
+            if safe:
+                # Handle potential dicts
+                safe_list = [str(x) for x in safe]
+                status_summary.append(f"🍴 {', '.join(safe_list[:2])}")
+        else:
+            for meal in cafe.get("meals", []):
+                v = meal.get("verdict", "")
+                if v == "SAFE":
+                    status_summary.append(f"✅ {meal.get('time')}")
+                elif v == "WORTH IT":
+                    status_summary.append(f"💰 {meal.get('time')}")
+    
+    if status_summary:
+        return f"*{day}*: {', '.join(status_summary[:3])}\n"
+    return f"*{day}*: Check with /today or /tomorrow\n"
+
+# --- PRE-RENDERED MESSAGES ---
+RENDER_VERSION = 1  # bump when format_message/format_week_line output changes
+
+def render_day(day, analysis, menu_hash):
+    """Every message variant for one day, built once when the analysis is saved."""
+    return {
+        "version": RENDER_VERSION,
+        "menu_hash": menu_hash,
+        "today": format_message(analysis, is_tomorrow=False),
+        "tomorrow": format_message(analysis, is_tomorrow=True),
+        "week_line": format_week_line(day, analysis or {})
+    }
+
+def make_cache_entry(day, analysis, menu_hash, timestamp=None):
+    """menu_cache.json entry with its rendered messages stored next to the analysis."""
+    return {
+        "timestamp": timestamp or datetime.now().isoformat(),
+        "analysis": analysis,
+        "menu_hash": menu_hash,
+        "rendered": render_day(day, analysis, menu_hash)
+    }
+
+def get_rendered(day):
+    """Rendered messages for a cached day (None if not cached).
+
+    Entries whose render is missing, from an older RENDER_VERSION or for a
+    different menu hash are re-rendered once and kept in memory.
+    """
+    entry = halal_lib.load_cache().get(day)
+    if not entry:
+        return None
+    rendered = entry.get("rendered")
+    if not rendered or rendered.get("version") != RENDER_VERSION or rendered.get("menu_hash") != entry.get("menu_hash"):
+        rendered = render_day(day, entry.get("analysis"), entry.get("menu_hash"))
+        entry["rendered"] = rendered
+    return rendered
+
 # --- TELEGRAM ---
+sender = TelegramSender(TELEGRAM_TOKEN, TELEGRAM_API)
+
+@halal_lib.metrics.timed("telegram.send")
 def send_telegram_message(chat_id, message):
     """Send message to Telegram."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "Markdown"
-    }
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code != 200:
-            payload["parse_mode"] = None
-            requests.post(url, json=payload, timeout=10)
-        return True
-    except Exception as e:
-        print(f"Telegram error: {e}")
-        return False
+    return sender.send(chat_id, message)
+
+# --- MENU FRESHNESS ---
+class MenuRefresher:
+    """Re-validates the menu hash in the background so commands never scrape.
+
+    refresh() fetches the pages, re-analyzes only days whose hash changed and
+    bumps the timestamp of the rest. Calls inside the debounce window are
+    skipped unless forced. Concurrent refreshes share one scrape, and each
+    (day, menu_hash, force) analysis runs once no matter how many callers
+    want it; a forced call never settles for a running unforced one.
+    """
+
+    def __init__(self, interval_minutes=MENU_REFRESH_MINUTES, debounce_seconds=REFRESH_DEBOUNCE_SECONDS):
+        self.interval = interval_minutes * 60
+        self.debounce = debounce_seconds
+        self.last_check = 0
+        self.fetches = halal_lib.SingleFlight()
+        self.analyses = halal_lib.SingleFlight()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def _analyze(self, menus, keys, run):
+        days = [day for day, _, _ in keys]
+        _, menu_hash, force = keys[0]
+        print(f"🤖 Re-analyzing {', '.join(days)}...")
+        results = halal_lib.analyze_menus(menus, days, force=force, run=run)
+        return {(day, menu_hash, force): result for day, result in results.items()}
+
+    def refresh(self, days=None, force=False):
+        """Bring the cache up to date.
+
+        Returns (re-analyzed day count, token run record). The run only counts
+        Gemini calls made by this refresh, not ones it waited on; it is None
+        when the call was debounced.
+        """
+        days = days or halal_lib.WEEKDAYS
+        if not force and time.time() - self.last_check < self.debounce:
+            return 0, None
+        menus = self.fetches.do("menus", halal_lib.fetch_menus)
+        current_hash = halal_lib.get_menu_hash(halal_lib.build_full_menu(menus))
+        
+        todo = [day for day in days if force or halal_lib.has_menu_changed(day, current_hash)]
+        refreshed = {}
+        run = halal_lib.get_token_ledger().start_run()
+        if todo:
+            results = self.analyses.do_many([(day, current_hash, force) for day in todo],
+                                            lambda keys: self._analyze(menus, keys, run))
+            refreshed = {day: result for (day, _, _), result in results.items() if result}
+        
+        now = datetime.now().isoformat()
+        def apply(cache):
+            for day in days:
+                if day in refreshed:
+                    cache[day] = make_cache_entry(day, refreshed[day], current_hash, now)
+                elif day not in todo and day in cache:
+                    cache[day] = dict(cache[day], timestamp=now)  # Checked, still current
+        halal_lib.update_cache(apply)
+        halal_lib.save_metrics()
+        self.last_check = time.time()
+        return len(refreshed), run
+
+    def request_refresh(self):
+        """Ask the background thread for a (debounced) refresh without waiting."""
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ Background refresh failed: {e}")
+
+    def start(self):
+        """Start the background refresher (once)."""
+        if self.thread is None and self.interval > 0:
+            self.thread = threading.Thread(target=self._run, name="menu-refresher", daemon=True)
+            self.thread.start()
+            self.request_refresh()  # Validate right away on startup
+
+menu_refresher = MenuRefresher()
 
 # --- ANALYSIS ---
 def run_analysis(chat_id=None, day_offset=0, force_refresh=False):
-    """Run menu analysis for a specific day."""
+    """Send the analysis for a specific day, straight from the cache."""
     target_chat = chat_id or TELEGRAM_CHAT_ID
     target_day = get_day_name(day_offset)
     is_tomorrow = day_offset == 1
     
     print(f"📅 Target day: {target_day}")
     
-    # Check cache first (skip fetch if cache valid and no refresh)
-    # But wait, we need to check HASH to know if menu changed. So we MUST fetch.
-    
-    # 1. Fetch menu
-    full_menu = halal_lib.fetch_all_menus()
-    current_hash = halal_lib.get_menu_hash(full_menu)
-    
-    # 2. Check Cache
-    use_cache = False
-    if not force_refresh and halal_lib.is_cache_valid(target_day):
-        if not halal_lib.has_menu_changed(target_day, current_hash):
-            print("📦 Using cached analysis (menu unchanged)...")
-            use_cache = True
-        else:
-            print("🔄 Menu changed! Re-analyzing...")
+    if force_refresh:
+        menu_refresher.refresh([target_day], force=True)
     
-    if use_cache:
+    result = halal_lib.get_cached_analysis(target_day)
+    if result is None:
+        # Nothing cached for this day yet: this request has to wait for one refresh
+        print("🔄 Not cached yet, refreshing...")
+        menu_refresher.refresh(sorted(set(halal_lib.WEEKDAYS) | {target_day}, key=get_day_index))
         result = halal_lib.get_cached_analysis(target_day)
+    elif not halal_lib.is_cache_valid(target_day):
+        print("🔄 Cache is old, refreshing in the background...")
+        menu_refresher.request_refresh()
     else:
-        print("🤖 Analyzing with Gemini...")
-        result = halal_lib.analyze_with_gemini(full_menu, target_day)
-        
-        # Save to cache with hash
-        if result:
-            halal_lib.save_cache(target_day, result, current_hash)
-            print("💾 Cached for future requests")
+        print("📦 Using cached analysis...")
     
     print("📤 Sending notification...")
-    message = format_message(result, is_tomorrow)
+    rendered = get_rendered(target_day) if result else None
+    message = rendered["tomorrow" if is_tomorrow else "today"] if rendered else format_message(result, is_tomorrow)
     success = send_telegram_message(target_chat, message)
     
     return success
 
 def run_week_analysis(chat_id):
     """Generate weekly overview (today + next 4 weekdays)."""
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+    days = halal_lib.WEEKDAYS
     today_idx = datetime.now().weekday()
     
     msg = "📅 *This Week's Pork-Free Overview*\n\n"
@@ -158,69 +293,196 @@ def run_week_analysis(chat_id):
         if i < today_idx:
             continue  # Skip past days
         
-        # Check cache
-        cache = halal_lib.load_cache()
-        if day in cache:
-            analysis = cache[day].get("analysis", {})
-            status_summary = []
-            for cafe in analysis.get("cafeterias", []):
-                if cafe.get("type") == "individual":
-                    safe = cafe.get("safe_options", [])
-                    if safe:
-                        # Handle potential dicts
-                        safe_list = [str(x) for x in safe]
-                        status_summary.append(f"🍴 {', '.join(safe_list[:2])}")
-                else:
-                    for meal in cafe.get("meals", []):
-                        v = meal.get("verdict", "")
-                        if v == "SAFE":
-                            status_summary.append(f"✅ {meal.get('time')}")
-                        elif v == "WORTH IT":
-                            status_summary.append(f"💰 {meal.get('time')}")
-            
-            if status_summary:
-                msg += f"*{day}*: {', '.join(status_summary[:3])}\n"
-            else:
-                msg += f"*{day}*: Check with /today or /tomorrow\n"
-        else:
-            msg += f"*{day}*: Not cached yet\n"
+        rendered = get_rendered(day)
+        msg += rendered["week_line"] if rendered else f"*{day}*: Not cached yet\n"
     
     msg += "\n_Use /today or /tomorrow for full details_"
     send_telegram_message(chat_id, msg)
 
+# --- SUBSCRIBERS ---
+SUBSCRIBERS_FILE = "subscribers.json"  # sorted list of chat ids
+_subscribers_lock = threading.Lock()
+
+def load_subscribers():
+    """Chat ids subscribed to the morning guide."""
+    try:
+        if os.path.exists(SUBSCRIBERS_FILE):
+            with open(SUBSCRIBERS_FILE, "r", encoding="utf-8") as f:
+                return set(json.load(f))
+    except:
+        pass
+    return set()
+
+def save_subscribers(chat_ids):
+    halal_lib.atomic_write_json(SUBSCRIBERS_FILE, sorted(chat_ids), separators=(",", ":"))
+
+def subscribe(chat_id):
+    """Add a chat; returns False if it was already subscribed."""
+    with _subscribers_lock:
+        chat_ids = load_subscribers()
+        if chat_id in chat_ids:
+            return False
+        chat_ids.add(chat_id)
+        save_subscribers(chat_ids)
+        return True
+
+def unsubscribe(chat_id):
+    """Remove a chat; returns False if it wasn't subscribed."""
+    with _subscribers_lock:
+        chat_ids = load_subscribers()
+        if chat_id not in chat_ids:
+            return False
+        chat_ids.discard(chat_id)
+        save_subscribers(chat_ids)
+        return True
+
+def drop_subscribers(chat_ids):
+    """Remove several chats at once (e.g. ones that blocked the bot)."""
+    with _subscribers_lock:
+        subscribed = load_subscribers()
+        if subscribed & set(chat_ids):
+            save_subscribers(subscribed - set(chat_ids))
+
+def broadcast_morning_guide(day_offset=0):
+    """Render today's guide once and fan it out to every subscriber. Returns delivered count."""
+    chat_ids = load_subscribers()
+    rendered = get_rendered(get_day_name(day_offset))
+    if not chat_ids or not rendered:
+        return 0
+    message = rendered["tomorrow" if day_offset == 1 else "today"]
+    results = sender.send_many(chat_ids, message)
+    delivered = sum(1 for ok in results.values() if ok)
+    print(f"📣 Morning guide delivered to {delivered}/{len(chat_ids)} subscribers")
+    gone = [chat_id for chat_id, ok in results.items() if not ok and chat_id in sender.gone]
+    if gone:
+        # Blocked the bot or deleted the chat: stop paying for them every morning
+        drop_subscribers(gone)
+        print(f"🧹 Unsubscribed {len(gone)} chat(s) that blocked the bot or no longer exist")
+    return delivered
+
 # --- BOT COMMANDS ---
-def check_bot_updates():
-    """Check for new messages/commands sent to the bot."""
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/getUpdates"
-    
-    offset_file = ".last_update_id"
-    last_update_id = 0
-    if os.path.exists(offset_file):
-        with open(offset_file, "r") as f:
+POLL_TIMEOUT_SECONDS = 30   # getUpdates long-poll timeout
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "8"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Prometheus /metrics on localhost, 0 = off
+SLOW_COMMANDS = {"/refresh"}  # run on their own worker so they never block /today
+OFFSET_FILE = ".last_update_id"
+JOURNAL_FILE = ".update_journal"
+
+def read_offset():
+    """Last processed update_id (0 if none)."""
+    if os.path.exists(OFFSET_FILE):
+        with open(OFFSET_FILE, "r") as f:
             try:
-                last_update_id = int(f.read().strip())
+                return int(f.read().strip())
             except:
                 pass
-    
-    try:
-        response = requests.get(url, params={"offset": last_update_id + 1, "timeout": 5}, timeout=10)
-        data = response.json()
-        
-        if not data.get("ok"):
-            return
+    return 0
+
+def write_offset(update_id):
+    # Rename over the old file so a crash never leaves it empty or half-written
+    halal_lib.atomic_write_json(OFFSET_FILE, update_id)
+
+class UpdateJournal:
+    """Offset kept in memory plus an append-only journal of in-progress updates.
+
+    Each poll appends one "begin" record per update (payload included) and
+    saves the offset once; every finished update appends a "done" record.
+    After a crash, updates that began but never finished are replayed, and
+    the journal is emptied whenever nothing is in flight.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offset = read_offset()
+        self.in_flight = {}  # update_id -> update
+
+    def _append(self, records):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def recover(self):
+        """Updates that began before a crash but never finished, oldest first."""
+        begun, done = {}, set()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except:
+                        continue  # torn last line from a crash
+                    if "begin" in record:
+                        begun[record["begin"].get("update_id", 0)] = record["begin"]
+                    elif "done" in record:
+                        done.add(record["done"])
         
-        for update in data.get("result", []):
+        with self.lock:
+            if begun:
+                # Journal is written before the offset, so it may be ahead of it
+                self.offset = max(self.offset, max(begun))
+                write_offset(self.offset)
+            self.in_flight = {uid: u for uid, u in begun.items() if uid not in done}
+            pending = [self.in_flight[uid] for uid in sorted(self.in_flight)]
+            if pending:
+                # Compact to just the pending records (temp file + rename, like the offset)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for update in pending:
+                        f.write(json.dumps({"begin": update}, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+        return pending
+
+    def begin(self, updates):
+        """Record a polled batch, then advance and persist the offset once."""
+        updates = [u for u in updates if u.get("update_id", 0) > self.offset]
+        if not updates:
+            return []
+        with self.lock:
+            self._append([{"begin": u} for u in updates])
+            for update in updates:
+                self.in_flight[update.get("update_id", 0)] = update
+            self.offset = max(self.offset, max(u.get("update_id", 0) for u in updates))
+            write_offset(self.offset)
+        return updates
+
+    def done(self, update):
+        with self.lock:
             update_id = update.get("update_id", 0)
-            message = update.get("message", {})
-            text = message.get("text", "")
-            chat_id = message.get("chat", {}).get("id")
-            user_name = message.get("from", {}).get("first_name", "User")
-            
-            print(f"📨 Received: '{text}' from {user_name}")
-            
-            if text in ["/start", "/check", "/menu", "/today"]:
-                if text == "/start":
-                    welcome_msg = f"""👋 *Welcome to Kumoh Pork-Free Bot!*
+            self.in_flight.pop(update_id, None)
+            if self.in_flight:
+                self._append([{"done": update_id}])
+            elif os.path.exists(self.path):
+                os.remove(self.path)  # nothing pending: start the next batch on an empty journal
+
+journal = UpdateJournal()
+
+def get_updates(offset, timeout=POLL_TIMEOUT_SECONDS):
+    """Long-poll Telegram for updates after `offset`; returns the update list."""
+    url = f"{TELEGRAM_API}/bot{TELEGRAM_TOKEN}/getUpdates"
+    response = requests.get(url, params={"offset": offset, "timeout": timeout}, timeout=timeout + 10)
+    data = response.json()
+    if not data.get("ok"):
+        return []
+    return data.get("result", [])
+
+@halal_lib.metrics.timed("bot.handle_update")
+def handle_update(update):
+    """Run the command in one update (blocking; called from a worker thread)."""
+    message = update.get("message", {})
+    text = message.get("text", "")
+    chat_id = message.get("chat", {}).get("id")
+    user_name = message.get("from", {}).get("first_name", "User")
+    
+    print(f"📨 Received: '{text}' from {user_name}")
+    
+    if text in ["/start", "/check", "/menu", "/today"]:
+        if text == "/start":
+            welcome_msg = f"""👋 *Welcome to Kumoh Pork-Free Bot!*
 
 I help students at Kumoh University find pork-free cafeteria meals.
 
@@ -233,6 +495,8 @@ Always verify ingredients if halal is important to you.
 /tomorrow - Tomorrow's menu
 /week - Weekly overview
 /refresh - Force refresh (bypass cache)
+/subscribe - Get the guide every weekday morning
+/unsubscribe - Stop the morning guide
 /feedback [msg] - Report errors
 /help - Show all commands
 
@@ -243,89 +507,161 @@ Always verify ingredients if halal is important to you.
 
 📦 Package = Full set meal
 🍴 Order = Pick individual dish"""
-                    send_telegram_message(chat_id, welcome_msg)
-                    send_telegram_message(chat_id, "⏳ Checking today's menu...")
-                else:
-                    send_telegram_message(chat_id, f"👋 Hi {user_name}! Checking today's pork-free menu...\n\n⏳ Please wait...")
-                run_analysis(chat_id, day_offset=0)
-                
-            elif text == "/tomorrow":
-                send_telegram_message(chat_id, f"👋 Hi {user_name}! Checking tomorrow's menu...\n\n⏳ Please wait...")
-                run_analysis(chat_id, day_offset=1)
+            send_telegram_message(chat_id, welcome_msg)
+            send_telegram_message(chat_id, "⏳ Checking today's menu...")
+        else:
+            send_telegram_message(chat_id, f"👋 Hi {user_name}! Checking today's pork-free menu...\n\n⏳ Please wait...")
+        run_analysis(chat_id, day_offset=0)
+        
+    elif text == "/tomorrow":
+        send_telegram_message(chat_id, f"👋 Hi {user_name}! Checking tomorrow's menu...\n\n⏳ Please wait...")
+        run_analysis(chat_id, day_offset=1)
+    
+    elif text == "/week":
+        send_telegram_message(chat_id, "📅 Getting weekly overview...")
+        run_week_analysis(chat_id)
+        
+    elif text == "/refresh":
+        # Admin-only command to protect API quota
+        if str(chat_id) == str(TELEGRAM_CHAT_ID):
+            send_telegram_message(chat_id, "🔄 Force refreshing ALL weekday menus...\n\n⏳ This may take a minute...")
             
-            elif text == "/week":
-                send_telegram_message(chat_id, "📅 Getting weekly overview...")
-                run_week_analysis(chat_id)
-                
-            elif text == "/refresh":
-                # Admin-only command to protect API quota
-                if str(chat_id) == str(TELEGRAM_CHAT_ID):
-                    send_telegram_message(chat_id, "🔄 Force refreshing ALL weekday menus...\n\n⏳ This may take a minute...")
-                    
-                    # Refresh all weekdays like morning_scrape
-                    full_menu = halal_lib.fetch_all_menus()
-                    current_hash = halal_lib.get_menu_hash(full_menu)
-                    
-                    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-                    cache = {}
-                    
-                    for day in days:
-                        print(f"🤖 Analyzing {day}...")
-                        result = halal_lib.analyze_with_gemini(full_menu, day)
-                        if result:
-                            from datetime import datetime as dt
-                            cache[day] = {
-                                "timestamp": dt.now().isoformat(),
-                                "analysis": result,
-                                "menu_hash": current_hash
-                            }
-                    
-                    halal_lib.save_full_cache(cache)
-                    send_telegram_message(chat_id, f"✅ Refreshed {len(cache)} days!\n\nUse /week to see the overview.")
-                else:
-                    send_telegram_message(chat_id, "⚠️ This command is admin-only to protect API quota.\n\nUse /today to get the latest cached menu.")
-                
-            elif text == "/help":
-                help_msg = """🤖 *Kumoh Pork-Free Bot*
+            # Refresh all weekdays like morning_scrape. A /refresh replayed after a
+            # crash only re-analyzes days whose menu changed since.
+            refreshed, run = menu_refresher.refresh(force=not update.get("replayed"))
+            used_today = halal_lib.get_token_ledger().used_today()
+            if run and run["calls"]:
+                cost = f"\n💰 This refresh: {run['prompt_tokens'] + run['output_tokens']} Gemini tokens (today: {used_today})"
+            else:
+                cost = f"\n💰 This refresh: no Gemini calls (today: {used_today})"
+            send_telegram_message(chat_id, f"✅ Refreshed {refreshed} days!{cost}\n\nUse /week to see the overview.")
+        else:
+            send_telegram_message(chat_id, "⚠️ This command is admin-only to protect API quota.\n\nUse /today to get the latest cached menu.")
+        
+    elif text == "/subscribe":
+        if subscribe(chat_id):
+            send_telegram_message(chat_id, "🔔 Subscribed! You'll get the pork-free guide every weekday morning.\n\nUse /unsubscribe to stop.")
+        else:
+            send_telegram_message(chat_id, "🔔 You're already subscribed.")
+    
+    elif text == "/unsubscribe":
+        if unsubscribe(chat_id):
+            send_telegram_message(chat_id, "🔕 Unsubscribed. Use /subscribe to get the morning guide again.")
+        else:
+            send_telegram_message(chat_id, "🔕 You weren't subscribed.")
+        
+    elif text == "/help":
+        help_msg = """🤖 *Kumoh Pork-Free Bot*
 
 Commands:
 /today - Today's pork-free menu
 /tomorrow - Tomorrow's menu
 /week - Weekly overview
 /refresh - Force refresh (new data)
+/subscribe - Morning guide every weekday
+/unsubscribe - Stop the morning guide
 /feedback [msg] - Report errors
 /help - Show this message
 
 ⚠️ This checks for PORK only.
 Not halal certified."""
-                send_telegram_message(chat_id, help_msg)
-                
-            elif text.startswith("/feedback"):
-                feedback_text = text.replace("/feedback", "").strip()
-                if feedback_text:
-                    with open("feedback_log.txt", "a", encoding="utf-8") as f:
-                        f.write(f"[{datetime.now()}] User: {user_name} (ID: {chat_id})\n")
-                        f.write(f"Feedback: {feedback_text}\n\n")
-                    
-                    admin_msg = f"📝 *New Feedback*\nFrom: {user_name} (ID: {chat_id})\nMessage: {feedback_text}"
-                    send_telegram_message(TELEGRAM_CHAT_ID, admin_msg)
-                    send_telegram_message(chat_id, "✅ Thank you! Your feedback has been sent to the admin.")
-                else:
-                    send_telegram_message(chat_id, "Usage: /feedback [your message]\nExample: /feedback Curry contains pork")
-            
-            with open(offset_file, "w") as f:
-                f.write(str(update_id))
-                
-    except Exception as e:
-        # Don't spam errors - only print occasionally
-        if not hasattr(check_bot_updates, 'error_count'):
-            check_bot_updates.error_count = 0
-        check_bot_updates.error_count += 1
+        send_telegram_message(chat_id, help_msg)
         
-        # Only print every 5th error to reduce spam
-        if check_bot_updates.error_count % 5 == 1:
-            print(f"⚠️ Network issue (error #{check_bot_updates.error_count}): Connection timeout")
-            print("   Bot will keep retrying automatically...")
+    elif text.startswith("/feedback"):
+        feedback_text = text.replace("/feedback", "").strip()
+        if feedback_text:
+            with open("feedback_log.txt", "a", encoding="utf-8") as f:
+                f.write(f"[{datetime.now()}] User: {user_name} (ID: {chat_id})\n")
+                f.write(f"Feedback: {feedback_text}\n\n")
+            
+            admin_msg = f"📝 *New Feedback*\nFrom: {user_name} (ID: {chat_id})\nMessage: {feedback_text}"
+            send_telegram_message(TELEGRAM_CHAT_ID, admin_msg)
+            send_telegram_message(chat_id, "✅ Thank you! Your feedback has been sent to the admin.")
+        else:
+            send_telegram_message(chat_id, "Usage: /feedback [your message]\nExample: /feedback Curry contains pork")
+
+def report_poll_error():
+    """Don't spam errors - only print every 5th one."""
+    report_poll_error.count = getattr(report_poll_error, "count", 0) + 1
+    if report_poll_error.count % 5 == 1:
+        print(f"⚠️ Network issue (error #{report_poll_error.count}): Connection timeout")
+        print("   Bot will keep retrying automatically...")
+
+def check_bot_updates():
+    """Check for new messages/commands sent to the bot (one short poll, handled in order)."""
+    try:
+        updates = journal.begin(get_updates(journal.offset + 1, timeout=5))
+    except Exception:
+        report_poll_error()
+        return
+    for update in updates:
+        try:
+            handle_update(update)
+        except Exception as e:
+            print(f"⚠️ Handler error: {e}")
+        finally:
+            journal.done(update)
+
+# --- ASYNC BOT ENGINE ---
+def is_slow_update(update):
+    text = update.get("message", {}).get("text", "")
+    return text.split(" ")[0] in SLOW_COMMANDS
+
+async def run_bot_async():
+    """Long-poll Telegram and hand every update to a bounded worker pool.
+
+    Handlers are blocking, so they run in threads off the event loop. Slow
+    commands get their own single worker and queue, so a /refresh never
+    delays anyone's /today.
+    """
+    loop = asyncio.get_running_loop()
+    fast_pool = ThreadPoolExecutor(max_workers=BOT_WORKERS, thread_name_prefix="bot-worker")
+    slow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-slow")
+    fast_queue = asyncio.Queue(maxsize=BOT_WORKERS * 4)
+    slow_queue = asyncio.Queue()
+    
+    async def worker(queue, pool):
+        while True:
+            update = await queue.get()
+            try:
+                await loop.run_in_executor(pool, handle_update, update)
+            except Exception as e:
+                print(f"⚠️ Handler error: {e}")
+            finally:
+                journal.done(update)
+                queue.task_done()
+    
+    workers = [asyncio.create_task(worker(fast_queue, fast_pool)) for _ in range(BOT_WORKERS)]
+    workers.append(asyncio.create_task(worker(slow_queue, slow_pool)))
+    
+    # Finish whatever was in progress when the bot last stopped
+    pending = journal.recover()
+    if pending:
+        print(f"♻️ Resuming {len(pending)} unfinished update(s)")
+    for update in pending:
+        update["replayed"] = True
+        await (slow_queue if is_slow_update(update) else fast_queue).put(update)
+    
+    retry_delay = 1
+    try:
+        while True:
+            try:
+                updates = await asyncio.to_thread(get_updates, journal.offset + 1)
+                retry_delay = 1
+            except Exception:
+                report_poll_error()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)  # Max 30 seconds
+                continue
+            
+            # One journal append + one offset write per poll, before any handler runs
+            for update in journal.begin(updates):
+                await (slow_queue if is_slow_update(update) else fast_queue).put(update)
+    finally:
+        for task in workers:
+            task.cancel()
+        fast_pool.shutdown(wait=False)
+        slow_pool.shutdown(wait=False)
 
 def main():
     print("=" * 50)
@@ -341,24 +677,15 @@ def main():
         print("🤖 Running in bot mode - listening for commands...")
         print("Press Ctrl+C to stop\n")
         
-        import time
-        retry_delay = 1  # Start with 1 second
-        
-        while True:
-            try:
-                check_bot_updates()
-                retry_delay = 1  # Reset on success
-                time.sleep(0.5)  # Small delay between checks
-            except KeyboardInterrupt:
-                print("\n\n👋 Bot stopped by user")
-                break
-            except Exception as e:
-                # Exponential backoff on repeated failures
-                print(f"⚠️ Unexpected error: {e}")
-                print(f"   Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-                retry_delay = min(retry_delay * 2, 30)  # Max 30 seconds
+        if METRICS_PORT:
+            halal_lib.serve_metrics(METRICS_PORT)
+        menu_refresher.start()
+        try:
+            asyncio.run(run_bot_async())
+        except KeyboardInterrupt:
+            print("\n\n👋 Bot stopped by user")
     else:
+        menu_refresher.refresh()
         run_analysis()
         print("\n✅ Done!")
         print("=" * 50)
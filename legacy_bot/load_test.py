@@ -0,0 +1,230 @@
+"""
+Bot load test
+Runs `kumoh_halal_bot.py --bot` against a local fake Bot API, injects
+synthetic /today, /week and /feedback updates at a set rate and reports
+reply latency percentiles, throughput and outbound request counts.
+
+    python load_test.py                      # 300 updates at 50/s, one chat each
+    python load_test.py --updates 2000 --rate 200 --users 50
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BOT_DIR)
+TOKEN = "loadtest"
+ADMIN_CHAT_ID = 1
+FIRST_USER_CHAT_ID = 1000
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Messages each command sends back to the user's chat (the /feedback copy to the admin isn't counted)
+REPLIES = {"/today": 2, "/week": 2, "/feedback": 1}
+
+# --- FAKE BOT API ---
+class FakeBotApi:
+    """In-memory getUpdates queue plus a sendMessage recorder."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.updates = []           # every injected update, in update_id order
+        self.sent = []              # (monotonic time, chat_id)
+        self.get_updates_calls = 0
+
+    def inject(self, chat_id, text):
+        with self.cond:
+            update = {
+                "update_id": len(self.updates) + 1,
+                "message": {"message_id": len(self.updates) + 1, "date": int(time.time()), "text": text,
+                            "chat": {"id": chat_id, "type": "private"},
+                            "from": {"id": chat_id, "first_name": f"User{chat_id}"}}
+            }
+            self.updates.append(update)
+            self.cond.notify_all()
+            return update
+
+    def get_updates(self, offset, timeout):
+        """Long poll like Telegram: updates with update_id >= offset, at most 100."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.get_updates_calls += 1
+            while len(self.updates) < offset and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            return self.updates[max(offset, 1) - 1:][:100]
+
+    def record_send(self, chat_id):
+        with self.cond:
+            self.sent.append((time.monotonic(), chat_id))
+
+class BotApiHandler(BaseHTTPRequestHandler):
+    api = None
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path.endswith("/getUpdates"):
+            updates = self.api.get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+            self.reply({"ok": True, "result": updates})
+        else:
+            self.reply({"ok": False, "description": "Not Found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)) or 0)
+        if self.path.endswith("/sendMessage"):
+            payload = json.loads(body or b"{}")
+            self.api.record_send(int(payload.get("chat_id", 0)))  # the bot sends the admin id as a string
+            self.reply({"ok": True, "result": {"message_id": 1}})
+        else:
+            self.reply({"ok": False, "description": "Not Found"})
+
+# --- BOT PROCESS ---
+def seed_workdir():
+    """Temp working dir whose menu_cache.json covers every day, so commands never scrape."""
+    workdir = tempfile.mkdtemp(prefix="bot-load-")
+    with open(os.path.join(REPO_DIR, "data", "menu_data.json"), "r", encoding="utf-8") as f:
+        week = json.load(f)["week_data"]
+    template = next(iter(week.values()))
+    now = datetime.now().isoformat()
+    cache = {
+        day: {"timestamp": now, "analysis": dict(week.get(day, template), day=day), "menu_hash": "loadtest"}
+        for day in DAY_NAMES
+    }
+    with open(os.path.join(workdir, "menu_cache.json"), "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    return workdir
+
+def start_bot(api_base, workdir, workers):
+    env = dict(os.environ, TELEGRAM_API_BASE=api_base, TELEGRAM_TOKEN=TOKEN,
+               TELEGRAM_CHAT_ID=str(ADMIN_CHAT_ID), MENU_REFRESH_MINUTES="0", PYTHONIOENCODING="utf-8")
+    if workers:
+        env["BOT_WORKERS"] = str(workers)
+    return subprocess.Popen([sys.executable, os.path.join(BOT_DIR, "kumoh_halal_bot.py"), "--bot"],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# --- LOAD ---
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        command, weight = part.split("=")
+        mix["/" + command.strip().lstrip("/")] = float(weight)
+    return mix
+
+def inject_load(api, count, rate, users, mix):
+    """Inject `count` updates at `rate`/s; returns [(inject time, chat_id, command)]."""
+    commands, weights = list(mix), list(mix.values())
+    injected = []
+    start = time.monotonic()
+    for i in range(count):
+        target = start + i / rate
+        delay = target - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        chat_id = FIRST_USER_CHAT_ID + (i % users if users else i)
+        command = random.choices(commands, weights)[0]
+        text = f"{command} load test message {i}" if command == "/feedback" else command
+        injected.append((time.monotonic(), chat_id, command))
+        api.inject(chat_id, text)
+    return injected
+
+def completion_times(api, injected):
+    """Time each update got its last reply; a chat's Nth update is done once it has all replies for 1..N."""
+    replies = {}
+    for sent_at, chat_id in api.sent:
+        replies.setdefault(chat_id, []).append(sent_at)
+    needed = {}
+    done = []
+    for injected_at, chat_id, command in injected:
+        needed[chat_id] = needed.get(chat_id, 0) + REPLIES[command]
+        times = replies.get(chat_id, [])
+        if len(times) >= needed[chat_id]:
+            done.append((injected_at, times[needed[chat_id] - 1]))
+    return done
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the bot against a local fake Telegram Bot API.")
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=50, help="updates injected per second")
+    parser.add_argument("--users", type=int, default=0, help="distinct chats (0 = a new chat per update)")
+    parser.add_argument("--mix", default="today=0.6,week=0.3,feedback=0.1")
+    parser.add_argument("--workers", type=int, default=0, help="BOT_WORKERS for the bot (default: bot's own)")
+    parser.add_argument("--timeout", type=float, default=300, help="give up waiting for replies after this many seconds")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    api = FakeBotApi()
+    BotApiHandler.api = api
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BotApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    workdir = seed_workdir()
+    bot = start_bot(api_base, workdir, args.workers)
+    print(f"🚀 Bot started against {api_base} (pid {bot.pid})")
+    try:
+        # Wait for the first long poll so start-up time isn't counted as latency
+        while api.get_updates_calls == 0 and bot.poll() is None:
+            time.sleep(0.05)
+        if bot.poll() is not None:
+            print(f"❌ Bot exited early (code {bot.returncode})")
+            return
+
+        print(f"📨 Injecting {args.updates} updates at {args.rate:g}/s...")
+        started = time.monotonic()
+        injected = inject_load(api, args.updates, args.rate, args.users, mix)
+        expected = sum(REPLIES[command] for _, _, command in injected)
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            with api.cond:
+                user_replies = sum(1 for _, chat_id in api.sent if chat_id != ADMIN_CHAT_ID)
+            if user_replies >= expected:
+                break
+            time.sleep(0.1)
+        finished = time.monotonic()
+    finally:
+        bot.terminate()
+        bot.wait(10)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    done = completion_times(api, injected)
+    latencies = [replied - injected_at for injected_at, replied in done]
+    print("\n📊 Results")
+    print(f"   Completed:  {len(done)}/{len(injected)} updates in {finished - started:.1f}s")
+    if latencies:
+        last_reply = max(replied for _, replied in done)
+        print(f"   Throughput: {len(done) / (last_reply - started):.1f} updates/s")
+        print("   Latency:    " + ", ".join(
+            f"p{int(q * 100)} {percentile(latencies, q) * 1000:.0f}ms" for q in (0.5, 0.9, 0.99)
+        ) + f", max {max(latencies) * 1000:.0f}ms")
+    print(f"   Outbound:   {len(api.sent)} sendMessage, {api.get_updates_calls} getUpdates")
+    print("   (replies are paced like real Telegram: 30 msg/s overall, 1 msg/s per chat with short bursts)")
+
+if __name__ == "__main__":
+    main()
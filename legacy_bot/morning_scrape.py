@@ -1,11 +1,13 @@
 """
 Morning Scrape Script
 Runs automatically each weekday morning to fetch and cache menu analysis.
-Cache is used for all user requests throughout the day.
+Cache is used for all user requests throughout the day, and today's guide
+is pushed to every /subscribe user.
 """
 import hashlib
 from datetime import datetime
 import halal_lib  # Shared library
+import kumoh_halal_bot  # Message rendering + subscriber broadcast
 
 def main():
     print("=" * 50)
@@ -13,15 +15,20 @@ def main():
     print("=" * 50)
     
     # Fetch menu
-    full_menu = halal_lib.fetch_all_menus()
+    with halal_lib.metrics.span("morning.fetch"):
+        menus = halal_lib.fetch_menus()
+    full_menu = halal_lib.build_full_menu(menus)
+    slowest = max(result["seconds"] for result in menus.values())
+    print(f"⏱️ Fetched {len(menus)} pages in {slowest:.2f}s (slowest page)")
     menu_hash = halal_lib.get_menu_hash(full_menu)
     
     # Load existing cache to check for unchanged menus
     existing_cache = halal_lib.load_cache()
 
     # Analyze each weekday
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+    days = halal_lib.WEEKDAYS
     cache = {}
+    todo = []
     
     for day in days:
         # Check if we can reuse existing analysis (same menu hash)
@@ -30,20 +37,33 @@ def main():
             cache[day] = existing_cache[day]
             cache[day]["timestamp"] = datetime.now().isoformat() # Update timestamp
         else:
-            print(f"🤖 Analyzing {day}...")
-            result = halal_lib.analyze_with_gemini(full_menu, day)
-            if result:
-                cache[day] = {
-                    "timestamp": datetime.now().isoformat(),
-                    "analysis": result,
-                    "menu_hash": menu_hash
-                }
+            todo.append(day)
+    
+    if todo:
+        print(f"🤖 Analyzing {', '.join(todo)}...")
+        results = halal_lib.analyze_menus(menus, todo)
+        for day, result in results.items():
+            cache[day] = kumoh_halal_bot.make_cache_entry(day, result, menu_hash)
+        for day in todo:
+            if day not in results and day in existing_cache:
+                # Failed or over the token budget: serve yesterday's verdicts until the next run
+                print(f"⚠️ Keeping cached analysis for {day}")
+                cache[day] = existing_cache[day]
     
     # Save cache
     halal_lib.save_full_cache(cache)
     
     print(f"\n✅ Cached {len(cache)} days of analysis!")
     print(f"💾 Saved to {halal_lib.CACHE_FILE}")
+    
+    # Push today's guide to /subscribe users (rendered once, sent to everyone)
+    if kumoh_halal_bot.TELEGRAM_TOKEN:
+        with halal_lib.metrics.span("morning.broadcast"):
+            kumoh_halal_bot.broadcast_morning_guide()
+    
+    # Where the minutes went
+    print("\n".join(halal_lib.metrics.summary()))
+    halal_lib.save_metrics()
     print("=" * 50)
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+"""
+Outbound Telegram sender
+Keep-alive session, per-chat + global rate limits that follow Telegram's
+429 retry_after, and parallel delivery for broadcasts.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import halal_lib  # RateLimiter, metrics
+
+# Telegram allows ~30 messages/second overall and ~1 message/second per chat on average;
+# short bursts (an ack plus its reply) go through, real overruns come back as 429 retry_after
+GLOBAL_MESSAGES_PER_SECOND = 30
+PER_CHAT_INTERVAL_SECONDS = 1.0
+PER_CHAT_BURST = 3
+SEND_RETRIES = 3
+# Errors meaning the chat will never accept messages again (blocked, deleted, kicked)
+GONE_DESCRIPTIONS = ("bot was blocked", "chat not found", "user is deactivated", "bot was kicked")
+SEND_WORKERS = 8
+
+def markdown_ok(text):
+    """Cheap check that legacy Markdown entities are balanced, so Telegram won't reject it."""
+    if text.count("*") % 2 or text.count("_") % 2 or text.count("`") % 2:
+        return False
+    return text.count("[") == text.count("]")
+
+class TelegramSender:
+    """Sends messages through one pooled session, respecting Telegram's flood limits."""
+
+    def __init__(self, token, api="https://api.telegram.org", workers=SEND_WORKERS):
+        self.url = f"{api}/bot{token}/sendMessage"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.workers = workers
+        self.limiter = halal_lib.RateLimiter(GLOBAL_MESSAGES_PER_SECOND * 60, burst=GLOBAL_MESSAGES_PER_SECOND)
+        self.lock = threading.Lock()
+        self.chat_tokens = {}      # chat_id -> (tokens, monotonic time) per-chat token bucket
+        self.chat_paused = {}      # chat_id -> monotonic time a 429 for that chat ends
+        self.paused_until = 0.0    # global pause after a 429
+        self.sent_count = 0
+        self.gone = set()          # chats that blocked the bot or no longer exist
+
+    def _wait_turn(self, chat_id):
+        """Block until both the chat and the global limits allow another message.
+
+        Each chat has a bucket of PER_CHAT_BURST messages refilled at one per
+        PER_CHAT_INTERVAL_SECONDS, so a reply right after an ack isn't delayed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self.chat_tokens.get(chat_id, (PER_CHAT_BURST, now))
+            tokens = min(PER_CHAT_BURST, tokens + (now - updated) / PER_CHAT_INTERVAL_SECONDS) - 1
+            self.chat_tokens[chat_id] = (tokens, now)
+            wait = max(-tokens * PER_CHAT_INTERVAL_SECONDS, self.paused_until - now, self.chat_paused.get(chat_id, 0.0) - now)
+        if wait > 0:
+            time.sleep(wait)
+        self.limiter.acquire()
+
+    def _flood_wait(self, chat_id, retry_after):
+        with self.lock:
+            until = time.monotonic() + retry_after
+            self.paused_until = max(self.paused_until, until)
+            self.chat_paused[chat_id] = max(self.chat_paused.get(chat_id, 0.0), until)
+
+    def send(self, chat_id, message, parse_mode="Markdown"):
+        """Send one message; returns True once Telegram accepted it."""
+        payload = {"chat_id": chat_id, "text": message}
+        if parse_mode and (parse_mode != "Markdown" or markdown_ok(message)):
+            payload["parse_mode"] = parse_mode
+
+        for attempt in range(SEND_RETRIES + 1):
+            self._wait_turn(chat_id)
+            try:
+                response = self.session.post(self.url, json=payload, timeout=10)
+            except Exception as e:
+                print(f"Telegram error: {e}")
+                halal_lib.metrics.count("telegram.retries")
+                time.sleep(2 ** attempt)
+                continue
+
+            if response.status_code == 200:
+                with self.lock:
+                    self.sent_count += 1
+                    self.gone.discard(chat_id)
+                halal_lib.metrics.count("telegram.sent")
+                return True
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            if response.status_code == 429:
+                retry_after = data.get("parameters", {}).get("retry_after", 1)
+                print(f"⏳ Telegram flood control: waiting {retry_after}s")
+                halal_lib.metrics.count("telegram.flood_waits")
+                self._flood_wait(chat_id, retry_after)
+                continue
+            if response.status_code == 400 and "parse" in data.get("description", "") and "parse_mode" in payload:
+                # Markdown that slipped past markdown_ok(); nothing was delivered, send as plain text
+                payload.pop("parse_mode")
+                continue
+            if response.status_code >= 500:
+                halal_lib.metrics.count("telegram.retries")
+                time.sleep(2 ** attempt)
+                continue
+            description = data.get("description", "")
+            print(f"Telegram error {response.status_code}: {description}")
+            if response.status_code == 403 or any(text in description.lower() for text in GONE_DESCRIPTIONS):
+                with self.lock:
+                    self.gone.add(chat_id)
+                halal_lib.metrics.count("telegram.gone")
+            halal_lib.metrics.count("telegram.failed")
+            return False
+        halal_lib.metrics.count("telegram.failed")
+        return False
+
+    def send_many(self, chat_ids, message, parse_mode="Markdown"):
+        """Deliver one message to many chats in parallel; returns {chat_id: delivered}."""
+        chat_ids = list(chat_ids)
+        if not chat_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chat_ids))) as pool:
+            futures = {chat_id: pool.submit(self.send, chat_id, message, parse_mode) for chat_id in chat_ids}
+            return {chat_id: future.result() for chat_id, future in futures.items()}
@@ -0,0 +1,218 @@
+"""
+Offline pipeline benchmark
+Serves cafeteria pages from bench_fixtures/ through a local HTTP server and
+answers Gemini prompts with a fake model, then reports wall time, peak
+allocations, bytes written and prompt tokens per stage.
+
+The bundled fixtures are synthetic pages in the live site's table layout
+(real dish names, placeholder navigation); use --record to replace them
+with the current live pages.
+
+    python scripts/bench_pipeline.py                 # 3 runs, 0.5s fake model latency
+    python scripts/bench_pipeline.py --latency 2 --runs 5
+    python scripts/bench_pipeline.py --record        # refresh fixtures from the live site
+"""
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import halal_lib
+import gen_menu
+
+FIXTURES_DIR = os.path.join(SCRIPT_DIR, "bench_fixtures")  # synthetic unless re-recorded
+LIVE_URLS = dict(halal_lib.URLS)
+
+# --- FAKE GEMINI ---
+class FakeResponse:
+    def __init__(self, text, prompt_tokens):
+        self.text = text
+        self.usage_metadata = {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": halal_lib.estimate_tokens(text)
+        }
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel: canned verdicts after `latency` seconds."""
+
+    def __init__(self, latency, stats):
+        self.latency = latency
+        self.stats = stats
+
+    @staticmethod
+    def day_reply(day):
+        meal = lambda t: {"time": t, "verdict": "SAFE", "main_dish": "Bench dish", "safe_items": ["Rice"],
+                          "skip_items": [], "reason": "Canned benchmark reply."}
+        return {"day": day, "cafeterias": [
+            {"name": "Student Cafeteria", "type": "package", "meals": [meal(t) for t in halal_lib.PACKAGE_TIMES]},
+            {"name": "Professor Cafeteria", "type": "package", "meals": [meal(t) for t in halal_lib.PACKAGE_TIMES]},
+            {"name": "A La Carte", "type": "individual", "safe_options": ["Bibimbap"], "avoid": ["Donkatsu"]}
+        ]}
+
+    def generate_content(self, prompt):
+        tokens = halal_lib.estimate_tokens(prompt)
+        with self.stats["lock"]:
+            self.stats["prompts"] += 1
+            self.stats["tokens"] += tokens
+        time.sleep(self.latency)
+        batch = re.search(r"TARGET DAYS: (.*)", prompt)
+        if batch:
+            days = [day.strip() for day in batch.group(1).split(",")]
+            reply = {"days": [self.day_reply(day) for day in days]}
+        else:
+            reply = self.day_reply(re.search(r"TARGET DAY: (\w+)", prompt).group(1))
+        return FakeResponse("```json\n" + json.dumps(reply, ensure_ascii=False) + "\n```", tokens)
+
+# --- LOCAL SITE ---
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def guess_type(self, path):
+        return "text/html; charset=utf-8"
+
+def serve_fixtures(directory):
+    """Serve the fixture pages on a free local port; returns (server, base_url)."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def record_fixtures(directory):
+    """Save the live cafeteria pages as fixtures."""
+    os.makedirs(directory, exist_ok=True)
+    for name, url in LIVE_URLS.items():
+        response = halal_lib.get_session().get(url, timeout=halal_lib.FETCH_TIMEOUT)
+        response.raise_for_status()
+        path = os.path.join(directory, url.rsplit("/", 1)[1])
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(response.text)
+        print(f"💾 {name}: {len(response.content)} bytes -> {path}")
+
+# --- MEASUREMENT ---
+def disk_snapshot(directory):
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def measure(stage, fn, workdir, model_stats, results, verbose=False):
+    """Run one stage and append its numbers to results[stage]."""
+    before = disk_snapshot(workdir)
+    prompts, tokens = model_stats["prompts"], model_stats["tokens"]
+    tracemalloc.reset_peak()
+    start_mem = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output):
+        value = fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - start_mem
+    after = disk_snapshot(workdir)
+    written = sum(size for path, (mtime, size) in after.items() if before.get(path, (None,))[0] != mtime)
+    results.setdefault(stage, []).append({
+        "seconds": seconds,
+        "peak_kib": peak / 1024,
+        "bytes_written": written,
+        "prompts": model_stats["prompts"] - prompts,
+        "tokens": model_stats["tokens"] - tokens
+    })
+    return value
+
+def point_at(workdir, base_url):
+    """Send every file and URL the pipeline touches to the bench sandbox."""
+    halal_lib.URLS = {name: base_url + url.rsplit("/", 1)[1] for name, url in LIVE_URLS.items()}
+    halal_lib.CACHE_FILE = os.path.join(workdir, "menu_cache.json")
+    halal_lib.HTTP_CACHE_FILE = os.path.join(workdir, "http_cache.json")
+    halal_lib.DISH_CACHE_FILE = os.path.join(workdir, "dish_cache.json")
+    halal_lib.TOKEN_USAGE_FILE = os.path.join(workdir, "token_usage.json")
+    halal_lib.RESPONSE_STORE_DIR = os.path.join(workdir, "llm_responses")
+    halal_lib.METRICS_FILE = os.path.join(workdir, "metrics.json")
+    halal_lib._http_cache = None
+    gen_menu.DATA_DIR = os.path.join(workdir, "data")
+    gen_menu.DATA_FILE = os.path.join(gen_menu.DATA_DIR, "menu_data.json")
+    gen_menu.MANIFEST_FILE = os.path.join(gen_menu.DATA_DIR, "manifest.json")
+    gen_menu.DAYS_DIR = os.path.join(gen_menu.DATA_DIR, "days")
+
+def run_once(base_url, model_stats, results, concurrent=True, verbose=False):
+    """One pass over every stage in a fresh sandbox."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        point_at(workdir, base_url)
+        step = functools.partial(measure, workdir=workdir, model_stats=model_stats, results=results, verbose=verbose)
+
+        menus = step("fetch (cold)", lambda: halal_lib.fetch_menus(concurrent))
+        step("fetch (304)", lambda: halal_lib.fetch_menus(concurrent))
+        step("menu text + hash", lambda: halal_lib.get_menu_hash(halal_lib.build_full_menu(menus)))
+        step("analyze week", lambda: halal_lib.analyze_menus(menus, halal_lib.WEEKDAYS))
+
+        # The generator starts over from an empty data/ and dish cache
+        point_at(tempfile.mkdtemp(prefix="gen-", dir=workdir), base_url)
+        step("gen_menu (new week)", gen_menu.main)
+        step("gen_menu (unchanged)", gen_menu.main)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def report(results, runs):
+    print(f"\n📊 Median of {runs} run(s)")
+    print(f"{'stage':<22}{'wall ms':>10}{'peak KiB':>10}{'written B':>11}{'prompts':>9}{'tokens':>8}")
+    for stage, samples in results.items():
+        median = lambda key: statistics.median(sample[key] for sample in samples)
+        print(f"{stage:<22}{median('seconds') * 1000:>10.1f}{median('peak_kib'):>10.0f}"
+              f"{median('bytes_written'):>11.0f}{median('prompts'):>9.0f}{median('tokens'):>8.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the scrape -> analyze -> publish pipeline.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini latency per call (seconds)")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory of restaurantNN.do pages")
+    parser.add_argument("--sequential", action="store_true", help="fetch pages one by one")
+    parser.add_argument("--record", action="store_true", help="save the live pages into --fixtures and exit")
+    parser.add_argument("--json", action="store_true", help="print raw samples as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.fixtures)
+        return
+
+    server, base_url = serve_fixtures(args.fixtures)
+    model_stats = {"prompts": 0, "tokens": 0, "lock": threading.Lock()}
+    halal_lib.GEMINI_API_KEY = halal_lib.GEMINI_API_KEY or "bench"
+    halal_lib.get_model = lambda: FakeModel(args.latency, model_stats)
+    # Real quota limits would only measure the sleep; keep concurrency, drop the per-minute cap
+    halal_lib.gemini_limiter = halal_lib.RateLimiter(60000, burst=halal_lib.GEMINI_MAX_IN_FLIGHT)
+
+    print(f"🏁 Benchmarking {args.runs} run(s), fake Gemini latency {args.latency}s, fixtures {args.fixtures}")
+    results = {}
+    tracemalloc.start()
+    try:
+        for _ in range(args.runs):
+            run_once(base_url, model_stats, results, not args.sequential, args.verbose)
+    finally:
+        tracemalloc.stop()
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results, args.runs)
+
+if __name__ == "__main__":
+    main()
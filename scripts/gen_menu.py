@@ -1,8 +1,14 @@
 import os
 import sys
 import json
+import gzip
 from datetime import datetime
 
+try:
+    import brotli  # Optional: also publish .br copies when available
+except ImportError:
+    brotli = None
+
 # Path setup - ensure we can import halal_lib from scripts/
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(SCRIPT_DIR)
@@ -10,7 +16,83 @@ sys.path.insert(0, SCRIPT_DIR)  # Add scripts/ to path for halal_lib
 
 import halal_lib
 
-DATA_FILE = os.path.join(BASE_DIR, "data", "menu_data.json")
+DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_FILE = os.path.join(DATA_DIR, "menu_data.json")   # full snapshot, read back by the next run
+MANIFEST_FILE = os.path.join(DATA_DIR, "manifest.json")  # what the dashboard polls
+DAYS_DIR = os.path.join(DATA_DIR, "days")               # one content-hashed file per weekday
+PRECOMPRESS = True  # emit .gz (and .br with brotli installed) next to each day file
+COMPACT = {"separators": (",", ":")}
+halal_lib.TOKEN_USAGE_FILE = os.path.join(BASE_DIR, "data", "token_usage.json")
+# Internal stores stay local (not published with data/, see .gitignore)
+halal_lib.HTTP_CACHE_FILE = os.path.join(BASE_DIR, "http_cache.json")
+halal_lib.DISH_CACHE_FILE = os.path.join(BASE_DIR, "dish_cache.json")
+halal_lib.METRICS_FILE = os.path.join(BASE_DIR, "metrics.json")
+halal_lib.RESPONSE_STORE_DIR = os.path.join(BASE_DIR, "llm_responses")
+
+def write_if_changed(path, data):
+    """Write compact JSON only when it differs from what's on disk. Returns True if written."""
+    text = json.dumps(data, ensure_ascii=False, **COMPACT)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    halal_lib.atomic_write_json(path, data, **COMPACT)
+    return True
+
+def write_day_file(day, analysis):
+    """Content-addressed day file (plus .gz/.br copies); returns its path relative to data/.
+
+    The hash is in the filename, so an existing file never changes and
+    browsers/CDNs can keep it forever.
+    """
+    text = json.dumps(analysis, ensure_ascii=False, **COMPACT)
+    name = f"{day}.{halal_lib.get_menu_hash(text)[:12]}.json"
+    path = os.path.join(DAYS_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(DAYS_DIR, exist_ok=True)
+        raw = text.encode("utf-8")
+        copies = {path: raw}
+        if PRECOMPRESS:
+            copies[path + ".gz"] = gzip.compress(raw, compresslevel=9, mtime=0)
+            if brotli:
+                copies[path + ".br"] = brotli.compress(raw)
+        for target, data in copies.items():
+            with open(target + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(target + ".tmp", target)
+        print(f"   💾 Wrote days/{name}")
+    return f"days/{name}"
+
+def remove_stale_day_files(keep):
+    """Delete day files no longer referenced by the current or previous manifest."""
+    if not os.path.isdir(DAYS_DIR):
+        return
+    for name in os.listdir(DAYS_DIR):
+        if name.split(".json")[0] + ".json" not in keep:
+            os.remove(os.path.join(DAYS_DIR, name))
+
+def publish(snapshot, updated_at):
+    """Write the snapshot, per-day files and the manifest that points at them."""
+    previous = {}
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            previous = json.load(f).get("days", {})
+    except:
+        pass
+    
+    day_files = {day: write_day_file(day, analysis) for day, analysis in snapshot.get("week_data", {}).items()}
+    
+    write_if_changed(DATA_FILE, snapshot)
+    write_if_changed(MANIFEST_FILE, {
+        "updated_at": updated_at,
+        "menu_hash": snapshot.get("menu_hash"),
+        "days": day_files
+    })
+    # Pages may serve the old manifest for a few minutes, so its files stay one more run
+    remove_stale_day_files({os.path.basename(p) for p in list(day_files.values()) + list(previous.values())})
 
 def main():
     print("=" * 50)
@@ -24,7 +106,11 @@ def main():
     
     # 1. Fetch Menu
     print("📥 Fetching menus from Kumoh website...")
-    full_menu = halal_lib.fetch_all_menus()
+    with halal_lib.metrics.span("gen.fetch"):
+        menus = halal_lib.fetch_menus()
+    full_menu = halal_lib.build_full_menu(menus)
+    slowest = max(result["seconds"] for result in menus.values())
+    print(f"⏱️ Fetched {len(menus)} pages in {slowest:.2f}s (slowest page)")
     menu_hash = halal_lib.get_menu_hash(full_menu)
     
     # 2. Check for Changes (Optimization)
@@ -43,44 +129,80 @@ def main():
     if old_hash == menu_hash:
         print("\n✨ Menu has NOT changed. Using existing analysis (Savings: 100% Tokens).")
         # We still might want to update the "updated_at" to show we checked
-        existing_data["updated_at"] = datetime.now().isoformat()
-        
-        # Save just the timestamp update
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
+        # (only the manifest changes; hashed day files stay cached in browsers)
+        existing_data.pop("updated_at", None)  # lived here before the manifest existed
+        with halal_lib.metrics.span("gen.publish"):
+            publish(existing_data, datetime.now().isoformat())
+        halal_lib.save_metrics()
             
-        print(f"✅ Data touched at {DATA_FILE}")
+        print(f"✅ Data touched at {MANIFEST_FILE}")
         return
 
-    # 3. Analyze ALL Weekdays (Mon-Fri)
+    # 3. Analyze only the (day, cafeteria) slices that changed
     # We want the dashboard to show the whole week
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+    days = halal_lib.WEEKDAYS
+    slice_hashes = halal_lib.get_slice_hashes(menus)
+    old_slices = existing_data.get("slice_hashes", {})
+    old_week = existing_data.get("week_data", {})
     week_data = {}
+    saved_slices = {}
     
-    print("\n🤖 Menu CHANGED! Starting AI analysis...")
-    print("   (This uses Gemini tokens - approx 5 calls)")
+    print("\n🤖 Menu CHANGED! Checking which days need AI analysis...")
     
+    changed_by_day = {}
     for day in days:
-        print(f"   > Analyzing {day}...")
-        result = halal_lib.analyze_with_gemini(full_menu, day)
-        if result:
-            week_data[day] = result
+        changed = [name for name in menus if slice_hashes[day][name] != old_slices.get(day, {}).get(name)]
+        if day in old_week and not changed:
+            print(f"   📦 {day}: unchanged, reusing analysis")
+            week_data[day] = old_week[day]
+            saved_slices[day] = slice_hashes[day]
+        elif day in old_week:
+            # Re-send only the changed cafeterias when we have something to merge into
+            changed_by_day[day] = changed
         else:
-            print(f"     ⚠️ Analysis failed for {day}")
+            changed_by_day[day] = list(menus)
+    
+    if changed_by_day:
+        todo = list(changed_by_day)
+        print(f"   > Analyzing {', '.join(todo)} (local rules first, then one batched AI call)...")
+        with halal_lib.metrics.span("gen.analyze"):
+            results = halal_lib.analyze_menus(menus, todo, changed_by_day)
+        
+        for day, changed in changed_by_day.items():
+            result = results.get(day)
+            if result:
+                partial = day in old_week and len(changed) < len(menus)
+                week_data[day] = halal_lib.merge_cafeterias(old_week[day], result, changed) if partial else result
+                saved_slices[day] = slice_hashes[day]
+            else:
+                print(f"     ⚠️ Analysis failed for {day}")
+                # Keep the old verdicts and old hashes so the slice is retried next run
+                if day in old_week:
+                    week_data[day] = old_week[day]
+                    saved_slices[day] = old_slices.get(day, {})
+    
+    # Keep the dashboard's day order regardless of which days were re-analyzed
+    week_data = {day: week_data[day] for day in days if day in week_data}
     
     # 4. Build Final JSON Structure
+    # The full hash is only recorded once every day is analyzed; until then the
+    # next run skips the "unchanged" shortcut and retries the missing slices
+    complete = all(saved_slices.get(day) == slice_hashes[day] for day in days)
+    if not complete:
+        print("   🔁 Some days are missing or stale - they will be retried next run")
     output = {
-        "updated_at": datetime.now().isoformat(),
-        "menu_hash": menu_hash,
+        "menu_hash": menu_hash if complete else None,
+        "slice_hashes": saved_slices,
         "week_data": week_data
     }
     
-    # 5. Save
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    # 5. Save (compact, and only the files whose content changed)
+    with halal_lib.metrics.span("gen.publish"):
+        publish(output, datetime.now().isoformat())
         
-    print(f"\n✅ Helper: Saved NEW analysis to {DATA_FILE}")
+    print(f"\n✅ Helper: Saved NEW analysis to {DATA_DIR}")
+    print("\n".join(halal_lib.metrics.summary()))
+    halal_lib.save_metrics()
     print("=" * 50)
 
 if __name__ == "__main__":
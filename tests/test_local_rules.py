@@ -0,0 +1,78 @@
+"""Local pork rules must never call a pork dish pork-free."""
+import os
+import sys
+
+import pytest
+from bs4 import BeautifulSoup
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+import halal_lib
+
+
+@pytest.fixture(autouse=True)
+def empty_dish_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(halal_lib, "DISH_CACHE_FILE", str(tmp_path / "dish_cache.json"))
+
+
+def lunch_menu(dishes):
+    """Student Cafeteria with one Monday lunch."""
+    table = halal_lib.MenuTable("Student Cafeteria", ["구분", "월"], [("중식", [dishes])])
+    return {"Student Cafeteria": {"table": table}}
+
+
+@pytest.mark.parametrize("dish", ["김치찜", "두부김치", "김치볶음", "김치전", "어묵볶음", "감자조림", "계란말이"])
+def test_ingredient_keyword_is_not_enough(dish):
+    assert halal_lib.classify_dish(dish) == halal_lib.UNKNOWN
+
+
+@pytest.mark.parametrize("dish", ["쌀밥", "잡곡밥", "배추김치", "김치", "깍두기", "잡곡밥(국내산)", "Steamed Rice"])
+def test_whole_staple_name_is_pork_free(dish):
+    assert halal_lib.classify_dish(dish) == halal_lib.PORK_FREE
+
+
+@pytest.mark.parametrize("dish", ["스팸구이", "돈육김치찜", "제육볶음", "Pork Cutlet"])
+def test_pork_keyword_anywhere(dish):
+    assert halal_lib.classify_dish(dish) == halal_lib.PORK
+
+
+def test_soup_is_not_the_main_dish():
+    assert halal_lib.main_dish_of(["잡곡밥", "콩나물국", "스팸구이", "배추김치"]) == "스팸구이"
+
+
+def test_pork_side_with_pork_free_main_goes_to_gemini():
+    statuses = {"쌀밥": halal_lib.PORK_FREE, "닭갈비": halal_lib.PORK_FREE, "소시지볶음": halal_lib.PORK}
+    assert halal_lib._local_package_meal("Lunch", list(statuses), statuses) is None
+
+
+@pytest.mark.parametrize("dishes", [["쌀밥", "소불고기", "배추김치"], ["잡곡밥", "치킨카츠", "깍두기"]])
+def test_suspicious_main_goes_to_gemini(dishes):
+    analysis, unknown = halal_lib.classify_day(lunch_menu(dishes), "Monday")
+    assert unknown == {"Student Cafeteria": {"중식"}}
+
+
+def test_pork_main_is_not_worth_locally():
+    analysis, unknown = halal_lib.classify_day(lunch_menu(["쌀밥", "제육볶음", "배추김치"]), "Monday")
+    assert not unknown
+    assert analysis["cafeterias"][0]["meals"][1]["verdict"] == "NOT WORTH"
+
+
+def test_fixture_spam_breakfast_is_never_worth_it():
+    path = os.path.join(SCRIPTS_DIR, "bench_fixtures", "restaurant01.do")
+    with open(path, "r", encoding="utf-8") as f:
+        table = halal_lib.MenuTable.from_html("Student Cafeteria", BeautifulSoup(f.read(), "html.parser").find("table"))
+    analysis, unknown = halal_lib.classify_day({"Student Cafeteria": {"table": table}}, "Wednesday")
+    breakfast = analysis["cafeterias"][0]["meals"][0]
+    assert breakfast["verdict"] != "WORTH IT"
+    labels = unknown.get("Student Cafeteria", set())
+    decided_locally = labels is not None and "Breakfast" not in {halal_lib.meal_time(label) for label in labels}
+    assert not decided_locally or breakfast["verdict"] == "NOT WORTH"
+
+
+def test_dish_cache_hit_does_not_rewrite_the_file(tmp_path):
+    cache = halal_lib.DishVerdictCache(str(tmp_path / "dishes.json"))
+    cache.put("소불고기", halal_lib.PORK_FREE, "ai")
+    cache.save()
+    assert cache.get("소불고기") == halal_lib.PORK_FREE
+    assert not cache.dirty
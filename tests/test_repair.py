@@ -0,0 +1,210 @@
+"""Gemini replies: JSON extraction, verdict spellings and schema repair."""
+import json
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+import halal_lib
+
+
+def meal(time, verdict="SAFE", main="닭갈비"):
+    return {"time": time, "verdict": verdict, "main_dish": main, "safe_items": [main], "skip_items": [], "reason": ""}
+
+
+def package(name, *meals):
+    return {"name": name, "type": "package", "meals": list(meals)}
+
+
+def full_day():
+    """A reply covering every cafeteria and meal."""
+    return {"day": "Monday", "cafeterias": [
+        package("Student Cafeteria", meal("Breakfast"), meal("Lunch"), meal("Dinner")),
+        package("Professor Cafeteria", meal("Breakfast"), meal("Lunch"), meal("Dinner")),
+        {"name": "A La Carte", "type": "individual", "safe_options": ["라면"], "avoid": ["돈까스"]},
+    ]}
+
+
+REPLY = {"day": "Monday", "cafeterias": [{"name": "A La Carte", "safe_options": ["라면"]}]}
+REPLY_TEXT = json.dumps(REPLY, ensure_ascii=False)
+
+
+@pytest.mark.parametrize("text, data, complete", [
+    (REPLY_TEXT, REPLY, True),
+    ("```json\n" + REPLY_TEXT + "\n```", REPLY, True),
+    ("Here is the analysis:\n" + REPLY_TEXT, REPLY, True),
+    (REPLY_TEXT + "\nLet me know if you need anything else! {not json}", REPLY, True),
+    ('{"day": "Monday", "cafeterias": [{"name": "A La Carte", "safe_options": ["라면"]}, {"name": "Stu',
+     {"day": "Monday", "cafeterias": [{"name": "A La Carte", "safe_options": ["라면"]}, {}]}, False),
+    ("[1, 2, 3", [1, 2], False),
+])
+def test_extract_json(text, data, complete):
+    assert halal_lib.extract_json(text) == (data, complete)
+
+
+@pytest.mark.parametrize("text", ["", "Sorry, I can't help with that.", "```\n```"])
+def test_extract_json_without_json(text):
+    with pytest.raises(ValueError):
+        halal_lib.extract_json(text)
+
+
+@pytest.mark.parametrize("text, closed", [
+    ('{"a": [1, 2', '{"a": [1]}'),
+    ('{"a": "x, y', '{}'),
+    ('{"a": {"b": 1}, "c": ', '{"a": {"b": 1}}'),
+    ('{"a": "say \\"hi\\", ok", "b', '{"a": "say \\"hi\\", ok"}'),
+    ("no brackets here", None),
+])
+def test_close_truncated(text, closed):
+    assert halal_lib._close_truncated(text) == closed
+
+
+@pytest.mark.parametrize("value, verdict", [
+    ("SAFE", "SAFE"),
+    ("safe", "SAFE"),
+    ("Worth it!", "WORTH IT"),
+    ("WORTH_IT", "WORTH IT"),
+    ("NOT WORTH", "NOT WORTH"),
+    ("not-worth", "NOT WORTH"),
+    ("UNSAFE", "NOT WORTH"),
+    ("Contains pork", "NOT WORTH"),
+    ("NONE", "NONE"),
+    ("N/A", "NONE"),
+    ("No meal", "NONE"),
+    ("SAFE/WORTH IT/NOT WORTH/NONE", None),
+    ("SAFE or NOT WORTH", None),
+    ("...", None),
+    ("", None),
+    (None, None),
+    ("maybe", None),
+])
+def test_normalize_verdict(value, verdict):
+    assert halal_lib.normalize_verdict(value) == verdict
+
+
+@pytest.mark.parametrize("meals, times, repaired", [
+    ([meal("Breakfast"), meal("Lunch"), meal("Dinner")], halal_lib.PACKAGE_TIMES, ["Breakfast", "Lunch", "Dinner"]),
+    ([meal("조식"), meal("중식"), meal("석식")], halal_lib.PACKAGE_TIMES, ["Breakfast", "Lunch", "Dinner"]),
+    ([meal("Breakfast"), meal("Lunch")], halal_lib.PACKAGE_TIMES, None),
+    ([meal("Breakfast"), meal("Lunch", "SAFE/WORTH IT/NOT WORTH/NONE"), meal("Dinner")], halal_lib.PACKAGE_TIMES, None),
+    ([meal("Lunch")], ["Lunch"], ["Lunch"]),
+    ([meal("Lunch"), meal("Dinner", "...")], ["Lunch"], ["Lunch"]),
+    ([meal("Dinner")], ["Lunch"], None),
+])
+def test_repair_cafeteria_meals(meals, times, repaired):
+    fixed = halal_lib._repair_cafeteria("Student Cafeteria", package("Student Cafeteria", *meals), times)
+    if repaired is None:
+        assert fixed is None
+    else:
+        assert [m["time"] for m in fixed["meals"]] == repaired
+
+
+def test_repair_cafeteria_flattens_dict_items():
+    cafe = {"name": "A La Carte", "safe_options": [{"menu": "라면"}, "우동"], "avoid": "돈까스"}
+    fixed = halal_lib._repair_cafeteria("A La Carte", cafe)
+    assert fixed["safe_options"] == ["라면", "우동"]
+    assert fixed["avoid"] == ["돈까스"]
+
+
+def test_repair_analysis_full_reply():
+    analysis, missing = halal_lib.repair_analysis(full_day(), "Monday")
+    assert missing == []
+    assert [cafe["name"] for cafe in analysis["cafeterias"]] == list(halal_lib.URLS)
+
+
+@pytest.mark.parametrize("drop, missing", [
+    (lambda day: day["cafeterias"][0]["meals"].pop(2), ["Student Cafeteria"]),
+    (lambda day: day["cafeterias"].pop(1), ["Professor Cafeteria"]),
+    (lambda day: day["cafeterias"][1]["meals"][0].update(verdict="..."), ["Professor Cafeteria"]),
+    (lambda day: day["cafeterias"][1].update(name="professor cafeteria "), []),
+    (lambda day: day.update(cafeterias="oops"), list(halal_lib.URLS)),
+])
+def test_repair_analysis_missing(drop, missing):
+    day = full_day()
+    drop(day)
+    assert halal_lib.repair_analysis(day, "Monday")[1] == missing
+
+
+def test_repair_analysis_truncated_reply_drops_the_last_cafeteria():
+    analysis, missing = halal_lib.repair_analysis(full_day(), "Monday", complete=False)
+    assert missing == ["A La Carte"]
+
+
+def test_subset_reply_is_valid_for_its_scope():
+    scope = {"Student Cafeteria": {"Lunch"}}
+    reply = {"cafeterias": [package("Student Cafeteria", meal("Lunch"))]}
+    analysis, missing = halal_lib.repair_analysis(reply, "Monday", scope=scope)
+    assert missing == []
+    assert [cafe["name"] for cafe in analysis["cafeterias"]] == ["Student Cafeteria"]
+    assert halal_lib.day_reply_ok("Monday", scope)(reply, True)
+    assert not halal_lib.day_reply_ok("Monday", scope)(reply, False)
+    assert not halal_lib.day_reply_ok("Monday")(reply, True)
+
+
+def test_subset_scope_ignores_other_cafeterias_in_the_reply():
+    scope = {"A La Carte": None}
+    analysis, missing = halal_lib.repair_analysis(full_day(), "Monday", scope=scope)
+    assert missing == []
+    assert [cafe["name"] for cafe in analysis["cafeterias"]] == ["A La Carte"]
+
+
+@pytest.fixture
+def fragment_reply(monkeypatch):
+    """Stub generate_json; set .reply to what the re-ask returns, .prompts collects the prompts."""
+    class Stub:
+        reply = None
+
+    stub = Stub()
+    stub.prompts = []
+
+    def generate_json(prompt, target_days, run=None, valid=None):
+        stub.prompts.append(prompt)
+        return stub.reply, True
+
+    monkeypatch.setattr(halal_lib, "generate_json", generate_json)
+    return stub
+
+
+def test_complete_analysis_merges_the_fragment(fragment_reply):
+    day = full_day()
+    day["cafeterias"][1]["meals"].pop()
+    fragment_reply.reply = {"cafeterias": [package("Professor Cafeteria", meal("Breakfast"), meal("Lunch"),
+                                                   meal("Dinner", "NOT WORTH", "제육볶음"))]}
+    analysis = halal_lib.complete_analysis("menu", "Monday", day)
+    assert len(fragment_reply.prompts) == 1
+    assert "ONLY THESE CAFETERIAS: Professor Cafeteria" in fragment_reply.prompts[0]
+    assert [cafe["name"] for cafe in analysis["cafeterias"]] == list(halal_lib.URLS)
+    assert analysis["cafeterias"][1]["meals"][2]["verdict"] == "NOT WORTH"
+    assert analysis["cafeterias"][0] == halal_lib.repair_analysis(full_day(), "Monday")[0]["cafeterias"][0]
+
+
+def test_complete_analysis_accepts_a_bare_list_fragment(fragment_reply):
+    day = full_day()
+    day["cafeterias"].pop(2)
+    fragment_reply.reply = [{"name": "A La Carte", "safe_options": ["라면"], "avoid": []}]
+    analysis = halal_lib.complete_analysis("menu", "Monday", day)
+    assert analysis["cafeterias"][2]["safe_options"] == ["라면"]
+
+
+def test_complete_analysis_gives_up_on_a_bad_fragment(fragment_reply):
+    day = full_day()
+    day["cafeterias"].pop(0)
+    fragment_reply.reply = {"cafeterias": [package("Student Cafeteria", meal("Lunch"))]}
+    assert halal_lib.complete_analysis("menu", "Monday", day) is None
+
+
+def test_complete_analysis_does_not_reask_an_empty_reply(fragment_reply):
+    assert halal_lib.complete_analysis("menu", "Monday", {"cafeterias": []}) is None
+    assert fragment_reply.prompts == []
+
+
+def test_complete_analysis_subset_scope_needs_no_reask(fragment_reply):
+    scope = {"Student Cafeteria": {"Lunch"}, "Professor Cafeteria": {"Dinner"}}
+    reply = {"cafeterias": [package("Student Cafeteria", meal("Lunch")),
+                            package("Professor Cafeteria", meal("Dinner"))]}
+    analysis = halal_lib.complete_analysis("menu", "Monday", reply, scope=scope)
+    assert fragment_reply.prompts == []
+    assert [cafe["name"] for cafe in analysis["cafeterias"]] == ["Student Cafeteria", "Professor Cafeteria"]
@@ -17,7 +17,7 @@ if %errorlevel% neq 0 (
 
 echo.
 echo 2. Uploading to GitHub...
-git add data/menu_data.json
+git add data/manifest.json data/menu_data.json data/days data/token_usage.json
 git commit -m "🍱 Manual Menu Update"
 git push
 